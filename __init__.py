@@ -1,16 +1,86 @@
 import datetime
-import pytz
+import os
 import calendar
-from typing import Optional
+import threading
+import time
+from typing import Optional, List, Union, Tuple, TYPE_CHECKING
 
 from adapt.intent import IntentBuilder
 from mycroft import Message
 from mycroft.skills.core import MycroftSkill, intent_handler
 from mycroft.util.log import LOG
-from mycroft.util.parse import extract_datetime
-from mycroft.util.format import nice_date
-from .pvoutput import PVOutput, NoStatusPVOutputException, DayStatistics, NoOutputsPVOutputException, \
-    InvalidApiKeyPVOutputException
+
+# pytz, mycroft.util.parse, mycroft.util.format and the client (which imports httplib2) are slow to import, so they
+# are imported when they are first needed instead of while the skill loads
+if TYPE_CHECKING:
+    from .pvoutput import PVOutput, DayStatistics, PVOutputStore, PVOutputFleet, MetricsRegistry, RequestMetrics, \
+        StatusSubscription, StatusDelta
+
+PREFETCH_INTERVAL = 300
+"""The number of seconds between prefetches. PVOutput systems usually upload a status every 5 minutes"""
+MAX_STALENESS = PREFETCH_INTERVAL + 60
+"""The maximum age in seconds of prefetched data that an intent answers with before making its own request"""
+PERIOD_NAMES = ("LastMonth", "ThisMonth", "LastYear", "ThisYear", "LastWeek", "ThisWeek")
+PREFETCH_PERIOD_NAMES = ("ThisWeek", "ThisMonth", "ThisYear")
+PEAK_DROP = 0.8
+"""The day's peak power is announced once generation stays below this fraction of it after PEAK_EARLIEST_DROP"""
+PEAK_DROP_STATUSES = 3
+"""The number of statuses in a row that must be below the drop, so a passing cloud doesn't count"""
+PEAK_EARLIEST_DROP = datetime.time(12)
+"""Drops before this time don't count, because the sun is still rising and generation usually recovers"""
+METRICS_FILE_NAME = "pvoutput.prom"
+"""Written after every prefetch, so node_exporter's textfile collector can export the client's metrics"""
+
+
+def log_request_metrics(metrics: "RequestMetrics"):
+    LOG.debug("PVOutput {} cache={} shared={} requests={} status={} wait={:.3f}s connect={:.3f}s "
+              "transfer={:.3f}s parse={:.3f}s total={:.3f}s remaining={} error={}".format(
+                  metrics.endpoint, metrics.cache, metrics.shared, metrics.requests, metrics.status,
+                  metrics.wait_time, metrics.connect_time, metrics.transfer_time, metrics.parse_time,
+                  metrics.total_time, metrics.rate_limit_remaining, metrics.error))
+
+
+def parse_systems(text: str, api_keys_text: str = "") -> List[Union[int, Tuple[int, str]]]:
+    """
+    Parses the other_systems setting, which is a comma separated list of system ids, like "1234, 5678".
+
+    :param api_keys_text: The other_api_keys setting, which is a comma separated list of system ids that have their
+                          own API key, each followed by a colon and the key, like "5678:abcdef"
+    """
+    api_keys = {}
+    for part in api_keys_text.split(","):
+        if part.strip():
+            (system_id, api_key) = part.split(":", 1)
+            api_keys[int(system_id)] = api_key.strip()
+    r = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if ":" in part:  # older settings kept the key with the id
+            (system_id, api_key) = part.split(":", 1)
+            r.append((int(system_id), api_key.strip()))
+        else:
+            system_id = int(part)
+            r.append((system_id, api_keys[system_id]) if system_id in api_keys else system_id)
+    return r
+
+
+class DateContext:
+    """The current day in the skill's timezone and things that are worked out from it, kept until midnight"""
+    __slots__ = ("timezone", "now", "today", "expires", "periods", "formatted_dates")
+
+    def __init__(self, timezone):
+        self.timezone = timezone
+        self.now = datetime.datetime.now(tz=timezone)
+        self.today = self.now.date()
+        midnight = datetime.datetime.combine(self.today + datetime.timedelta(days=1), datetime.time())
+        self.expires = (midnight if timezone is None else timezone.localize(midnight)).timestamp()
+        """The epoch time that this context is for a different day at"""
+        self.periods = {}
+        """A map of period name to its start and end date"""
+        self.formatted_dates = {}
+        """A map of date to how it is spoken"""
 
 
 class PVOutputSkill(MycroftSkill):
@@ -18,6 +88,40 @@ class PVOutputSkill(MycroftSkill):
         super().__init__(name="PVOutput")
         # import httplib2
         # httplib2.debuglevel = 1
+        self.pvoutput: Optional["PVOutput"] = None
+        """The client is built by the first intent or prefetch and kept until the settings change"""
+        self.store: Optional["PVOutputStore"] = None
+        self.fleet: Optional["PVOutputFleet"] = None
+        self.fleet_settings = None
+        self.metrics: Optional["MetricsRegistry"] = None
+        self.__client_lock = threading.Lock()
+        """Guards building and closing the client, store, metrics and fleet, which prefetches and intents share"""
+        self.__timezone = None
+        """A tuple of the timezone name and the pytz timezone"""
+        self.__date_context: Optional[DateContext] = None
+        self.subscription: Optional["StatusSubscription"] = None
+        """Polls for new statuses while the notifications setting is on"""
+        self.day_peak = None
+        """The status with the highest power generation today"""
+        self.day_peak_announced = False
+        self.day_peak_drops = 0
+        """The number of statuses in a row that have been below the drop from the day's peak"""
+        self.exporting: Optional[bool] = None
+
+    def initialize(self):
+        self.settings_change_callback = self.on_settings_changed
+        self.schedule_repeating_event(self.prefetch, None, PREFETCH_INTERVAL, name="PVOutputPrefetch")
+
+    def on_settings_changed(self):
+        """Closes the client and fleet so the next intent builds them with the new settings"""
+        self.stop_notifications()
+        with self.__client_lock:
+            if self.fleet is not None:
+                self.fleet.close()
+                self.fleet = None
+            if self.pvoutput is not None:
+                self.pvoutput.close()
+                self.pvoutput = None
 
     @property
     def use_24hour(self):
@@ -25,29 +129,184 @@ class PVOutputSkill(MycroftSkill):
 
     @property
     def timezone(self):
-        timezone = self.location_timezone
-        if not timezone:
+        name = self.location_timezone
+        if not name:
             return None
-        return pytz.timezone(timezone)
+        if self.__timezone is None or self.__timezone[0] != name:
+            import pytz
+            self.__timezone = (name, pytz.timezone(name))
+        return self.__timezone[1]
+
+    def get_date_context(self) -> DateContext:
+        """:return: The context of the current day, which is only created again once the day or timezone changes"""
+        context = self.__date_context
+        timezone = self.timezone
+        if context is None or time.time() >= context.expires or context.timezone is not timezone:
+            context = self.__date_context = DateContext(timezone)
+        return context
 
     def time_to_str(self, time):
         if self.use_24hour:
             return time.strftime("%H:%M")
         return time.strftime("%I:%M %p")
 
-    def get_pvoutput(self) -> Optional[PVOutput]:
+    def get_client(self) -> Optional["PVOutput"]:
+        """
+        :return: The client for the configured system, or None if the skill isn't set up
+        """
+        pvo = self.pvoutput
+        if pvo is not None:
+            return pvo
         api_key = self.settings.get("api_key")
         system_id = self.settings.get("system_id")
-        if api_key and system_id:
+        if not (api_key and system_id):
+            return None
+        from .pvoutput import PVOutput, ResponseCache, PVOutputStore, RateLimiter, RetryPolicy, MetricsRegistry
+        with self.__client_lock:
+            if self.pvoutput is not None:  # built by another thread while this one waited
+                return self.pvoutput
             LOG.info("Set up pv output for system id: {}".format(system_id))
-            return PVOutput(api_key=api_key, system_id=system_id)
+            if self.store is None:
+                self.store = PVOutputStore(os.path.join(self.file_system.path, "pvoutput.db"))
+            if self.metrics is None:
+                self.metrics = MetricsRegistry()
+            # a short timeout and a single retry so someone waiting for an answer never waits long
+            self.pvoutput = PVOutput(api_key=api_key, system_id=system_id, timeout=4,
+                                     cache=ResponseCache(status_ttl=MAX_STALENESS, statistic_ttl=MAX_STALENESS),
+                                     store=self.store, rate_limiter=RateLimiter(),
+                                     retry_policy=RetryPolicy(retries=1), hooks=[self.metrics, log_request_metrics])
+            return self.pvoutput
+
+    def get_pvoutput(self) -> Optional["PVOutput"]:
+        pvo = self.get_client()
+        if pvo:
+            return pvo
         self.speak_dialog("pvoutput.not.setup")
-        LOG.info("No pvoutput setup id: {}".format(system_id))
+        LOG.info("No pvoutput setup id: {}".format(self.settings.get("system_id")))
         return None
 
+    def get_fleet(self) -> Optional["PVOutputFleet"]:
+        """
+        :return: A fleet of the configured system and the systems in the other_systems setting, or None if the skill
+                 isn't set up
+        """
+        pvo = self.get_pvoutput()
+        if not pvo:
+            return None
+        other_systems = self.settings.get("other_systems") or ""
+        other_api_keys = self.settings.get("other_api_keys") or ""
+        fleet_settings = (pvo, other_systems, other_api_keys)
+        with self.__client_lock:
+            if self.fleet is None or self.fleet_settings != fleet_settings:
+                from .pvoutput import PVOutputFleet
+                if self.fleet is not None:
+                    self.fleet.close()
+                try:
+                    systems = [pvo.system_id] + parse_systems(other_systems, other_api_keys)
+                except ValueError:
+                    LOG.warning("Invalid other systems: {}".format(other_systems))
+                    systems = [pvo.system_id]
+                # shares the client's retry policy, circuit breaker and request coalescing
+                self.fleet = PVOutputFleet(systems, default_client=pvo)
+                self.fleet_settings = fleet_settings
+            return self.fleet
+
+    def prefetch(self, message=None):
+        """
+        Refreshes the live status and today's statistics, and keeps this week, month and year warm so that intents
+        can be answered from the cache instead of waiting on pvoutput.org.
+        """
+        pvo = self.get_client()
+        if not pvo:
+            return
+        from .pvoutput import request_priority, PRIORITY_BACKGROUND
+        # the checkbox setting can arrive as the string "false", which is truthy
+        if self.settings.get("notifications") in (True, "true", "True"):
+            self.start_notifications(pvo)
+        else:
+            self.stop_notifications()
+        today = self.get_date_context().today
+        try:
+            with request_priority(PRIORITY_BACKGROUND):
+                self.prefetch_with(pvo, today)
+        except Exception as e:  # an intent will make its own request if this fails
+            LOG.warning("Could not prefetch PVOutput data: {}".format(e))
+        self.write_metrics()
+
+    def start_notifications(self, pvo: "PVOutput"):
+        if self.subscription is None:
+            self.subscription = pvo.subscribe(
+                self.on_status_delta, interval=PREFETCH_INTERVAL, today=lambda: self.get_date_context().today,
+                error_callback=lambda e: LOG.info("Could not poll statuses: {}".format(e)))
+
+    def stop_notifications(self):
+        if self.subscription is not None:
+            self.subscription.stop()
+            self.subscription = None
+
+    def on_status_delta(self, delta: "StatusDelta"):
+        """Speaks when generation has peaked for the day and when power starts being exported"""
+        # the first statuses of a day, or of the subscription, only set the state, because they may be hours old
+        quiet = delta.previous is None
+        if quiet:
+            self.day_peak = None
+            self.day_peak_announced = False
+            self.day_peak_drops = 0
+            self.exporting = None
+        for status in delta.statuses:
+            power = status.instantaneous_power
+            if self.day_peak is None or power > self.day_peak.instantaneous_power:
+                self.day_peak = status
+                self.day_peak_drops = 0
+            elif power < self.day_peak.instantaneous_power * PEAK_DROP and status.time >= PEAK_EARLIEST_DROP:
+                self.day_peak_drops += 1
+            else:
+                self.day_peak_drops = 0
+            if not self.day_peak_announced and self.day_peak_drops >= PEAK_DROP_STATUSES:
+                self.day_peak_announced = True
+                if not quiet:
+                    self.speak_dialog("generation.peaked", data={
+                        "amount": self.day_peak.instantaneous_power / 1000.0,
+                        "time": self.time_to_str(self.day_peak.time)})
+            exporting = status.power_consumption is not None and power > status.power_consumption
+            if exporting and self.exporting is False and not quiet:
+                self.speak_dialog("now.exporting", data={"amount": (power - status.power_consumption) / 1000.0})
+            self.exporting = exporting
+
+    def write_metrics(self):
+        if self.metrics is None:
+            return
+        path = os.path.join(self.file_system.path, METRICS_FILE_NAME)
+        try:
+            with open(path + ".tmp", "w") as file:
+                file.write(self.metrics.to_prometheus())
+            os.replace(path + ".tmp", path)  # so a collector never reads a half written file
+        except OSError as e:
+            LOG.warning("Could not write PVOutput metrics: {}".format(e))
+
+    def prefetch_with(self, pvo: "PVOutput", today: datetime.date):
+        pvo.get_status(max_age=0)
+        pvo.get_status(date=today, day_statistics=True, max_age=0)
+        if self.store is not None:
+            pvo.sync_outputs(self.store, datetime.date(today.year - 1, 1, 1), today)
+        # the first statistic refreshes the recent outputs that every period ending today is computed from, which
+        # would otherwise only expire every other prefetch and leave intents to request them in between
+        max_age = 0
+        for name in PREFETCH_PERIOD_NAMES:
+            (start, end) = self.get_named_period(name, today)
+            for consumption_and_import in (False, True):
+                pvo.get_statistic(date_from=start, date_to=end, consumption_and_import=consumption_and_import,
+                                  max_age=max_age)
+                max_age = None
+
     def format_date(self, date: datetime.date):
-        return nice_date(datetime.datetime(date.year, date.month, date.day),
-                         now=datetime.datetime.now(tz=self.timezone))
+        context = self.get_date_context()
+        formatted = context.formatted_dates.get(date)
+        if formatted is None:
+            from mycroft.util.format import nice_date
+            formatted = context.formatted_dates[date] = nice_date(datetime.datetime(date.year, date.month, date.day),
+                                                                  now=context.now)
+        return formatted
 
     def nice_format_period(self, date1, date2):
         if date1 == date2:
@@ -62,6 +321,7 @@ class PVOutputSkill(MycroftSkill):
         utterance = message.data.get("utterance", "")
         now = datetime.datetime.now(tz=self.timezone)
         today = now.date()
+        from mycroft.util.parse import extract_datetime
         result = extract_datetime(utterance, anchorDate=now)
         if result is None:
             return today
@@ -71,44 +331,56 @@ class PVOutputSkill(MycroftSkill):
             date = result[0].date()
         return date
 
-    def get_this_week_start_date(self):
-        today = datetime.datetime.now(tz=self.timezone).date()
+    def get_this_week_start_date(self, today: Optional[datetime.date] = None):
+        today = today or self.get_date_context().today
         weekday = (today.weekday() + 1) % 7  # TODO only add 1 if that's normal for someone's language/region
         return today - datetime.timedelta(days=weekday)
 
-    def get_period(self, message: Message):
-        utterance = message.data.get("utterance", "")
-        today = datetime.datetime.now(tz=self.timezone).date()
-        start = None
-        end = None
-        if self.voc_match(utterance, "LastMonth"):
+    def get_named_period(self, name: str, today: datetime.date):
+        """
+        :param name: One of :data:`PERIOD_NAMES`
+        :return: A tuple of the start and end date of the period
+        """
+        if name == "LastMonth":
             if today.month == 1:
                 start = datetime.date(today.year - 1, 12, 1)
             else:
                 start = datetime.date(today.year, today.month - 1, 1)
             end = datetime.date(start.year, start.month, calendar.monthrange(start.year, start.month)[1])
-        elif self.voc_match(utterance, "ThisMonth"):
+        elif name == "ThisMonth":
             start = datetime.date(today.year, today.month, 1)
             end = today
-        elif self.voc_match(utterance, "LastYear"):
+        elif name == "LastYear":
             start = datetime.date(today.year - 1, 1, 1)
             end = datetime.date(today.year - 1, 12, 31)
-        elif self.voc_match(utterance, "ThisYear"):
+        elif name == "ThisYear":
             start = datetime.date(today.year, 1, 1)
             end = today
-        elif self.voc_match(utterance, "LastWeek"):
-            start = self.get_this_week_start_date() - datetime.timedelta(days=7)
+        elif name == "LastWeek":
+            start = self.get_this_week_start_date(today) - datetime.timedelta(days=7)
             end = start + datetime.timedelta(days=6)
-        elif self.voc_match(utterance, "ThisWeek"):
-            start = self.get_this_week_start_date()
+        elif name == "ThisWeek":
+            start = self.get_this_week_start_date(today)
             end = start + datetime.timedelta(days=6)
-
-        if not start:
-            return None
+        else:
+            raise ValueError("Unknown period: {}".format(name))
         return start, end
 
+    def get_period(self, message: Message):
+        utterance = message.data.get("utterance", "")
+        context = self.get_date_context()
+        for name in PERIOD_NAMES:
+            if self.voc_match(utterance, name):
+                period = context.periods.get(name)
+                if period is None:
+                    period = context.periods[name] = self.get_named_period(name, context.today)
+                return period
+        return None
+
     def handle_errors(self, function, date_string):
-        date_string = date_string or self.format_date(datetime.datetime.now(tz=self.timezone).date())
+        from .pvoutput import NoStatusPVOutputException, NoOutputsPVOutputException, InvalidApiKeyPVOutputException, \
+            RateLimitExceededPVOutputException, ServiceUnavailablePVOutputException
+        date_string = date_string or self.format_date(self.get_date_context().today)
         try:
             function()
         except (NoStatusPVOutputException, NoOutputsPVOutputException) as e:
@@ -117,6 +389,16 @@ class PVOutputSkill(MycroftSkill):
         except InvalidApiKeyPVOutputException as e:
             LOG.info(e)
             self.speak_dialog("invalid.api.key")
+        except RateLimitExceededPVOutputException as e:
+            LOG.info(e)
+            minutes = 60
+            if e.reset_time is not None:
+                seconds = (e.reset_time - datetime.datetime.now(tz=datetime.timezone.utc)).total_seconds()
+                minutes = max(1, int(seconds / 60 + 0.5))
+            self.speak_dialog("rate.limit.exceeded", {"minutes": minutes})
+        except ServiceUnavailablePVOutputException as e:
+            LOG.info(e)
+            self.speak_dialog("service.unavailable")
 
     def process_message_for_statistic(self, message, process_statistic, consumption_and_import=False):
         pvo = self.get_pvoutput()
@@ -142,6 +424,30 @@ class PVOutputSkill(MycroftSkill):
             self.speak_dialog("energy.generated", data={"amount": generated_watt_hours / 1000.0, "date": date_string})
         self.process_message_for_statistic(message, process_statistic)
 
+    @intent_handler(IntentBuilder("Energy Generated All Systems").require("Energy").require("Generated")
+                    .require("AllSystems").optionally("Solar").optionally("PVOutput"))
+    def energy_generated_all_systems(self, message):
+        fleet = self.get_fleet()
+        if not fleet:
+            return
+        period = self.get_period(message)
+        if not period:
+            date = self.get_date(message)
+            period = (date, date)
+        date_string = self.nice_format_period(period[0], period[1])
+
+        def function():
+            fleet_results = fleet.get_statistic(date_from=period[0], date_to=period[1])
+            for system_id, error in fleet_results.errors.items():
+                LOG.info("Could not get statistic for system id: {}. {}".format(system_id, error))
+            if not fleet_results.results:
+                raise next(iter(fleet_results.errors.values()))
+            generated_watt_hours = sum(statistic.energy_generated for statistic in fleet_results.results.values())
+            self.speak_dialog("energy.generated.all.systems", data={"amount": generated_watt_hours / 1000.0,
+                                                                    "count": len(fleet_results.results),
+                                                                    "date": date_string})
+        self.handle_errors(function, date_string)
+
     @intent_handler(IntentBuilder("Energy Used").require("Energy").require("Used").optionally("Solar")
                     .optionally("PVOutput"))
     def energy_used(self, message):
@@ -182,13 +488,27 @@ class PVOutputSkill(MycroftSkill):
         date = self.get_date(message)
 
         def function():
-            status: DayStatistics = pvo.get_status(date=date, day_statistics=True)
+            status: "DayStatistics" = pvo.get_status(date=date, day_statistics=True)
             peak_power = status.standard.peak_power
             time: datetime.time = status.standard.peak_power_time
             self.speak_dialog("peak.power", data={"amount": peak_power / 1000.0, "time": self.time_to_str(time),
                                                   "date": self.format_date(date)})
         self.handle_errors(function, self.format_date(date))
 
+    def shutdown(self):
+        self.stop_notifications()
+        with self.__client_lock:
+            if self.fleet is not None:
+                self.fleet.close()
+                self.fleet = None
+            if self.pvoutput is not None:
+                self.pvoutput.close()
+                self.pvoutput = None
+            if self.store is not None:
+                self.store.close()
+                self.store = None
+        super().shutdown()
+
 
 def create_skill():
     return PVOutputSkill()
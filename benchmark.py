@@ -0,0 +1,405 @@
+"""
+Benchmarks for the PVOutput client that run against a local stand-in for pvoutput.org, so they don't need an
+API key and don't use up the hourly request limit.
+
+Run with: python benchmark.py
+Pass the names of benchmarks to only run those, --latency to simulate the network and --json to save the results
+so they can be compared between versions.
+"""
+import argparse
+import datetime
+import http.server
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import httplib2
+
+from pvoutput import PVOutput, Httplib2Transport, Transport, HttpResponse, ResponseCache, HistoryStatus, \
+    HistoryColumns, iter_history, parse_history, parse_history_columns, parse_status, parse_day_statistics, \
+    parse_statistic, parse_outputs
+
+STATUS_PAYLOAD = "20210305,14:05,8613,1702,1004,412,0.395,NaN,NaN"
+EXTENDED_STATUS_PAYLOAD = "20210305,14:05,8613,1702,10040,412,0.395,24.3,245.1,5.1,NaN,1200,17.5,NaN,0.98"
+DAY_STATISTICS_PAYLOAD = "15127,2340,3977,12:35;10245,850,120,03:10;12.5,27.1,19.6"
+STATISTIC_PAYLOAD = ("246800,246800,8226,2000,11400,3.358,30,20210201,20210302,4.653,20210206,"
+                     "312500,102000,150000,40000,20500,10416,7500,15100,45.52,37.14")
+
+
+def history_payload(days=1, rows_per_day=288):
+    """
+    Creates a getstatus.jsp?h=1&ext=1 response with 5 minute rows, newest first, like pvoutput.org returns.
+    Consumption, voltage and some extended values are NaN, like they are for systems that only upload generation.
+    """
+    rows = []
+    for day in range(days):
+        date = (datetime.date(2021, 3, 5) - datetime.timedelta(days=day)).strftime("%Y%m%d")
+        for i in reversed(range(rows_per_day)):
+            minutes = i * 5
+            rows.append("{},{:02d}:{:02d},{},{:.3f},{},{},{:.3f},NaN,NaN,{:.1f},NaN,{:.1f},NaN".format(
+                date, minutes // 60, minutes % 60, i * 30, i * 0.007, i * 10, i * 9, i * 0.002, 20 + i / 100,
+                i / 10))
+    return ";".join(rows)
+
+
+def output_payload(date_from: datetime.date, date_to: datetime.date):
+    """Creates a getoutput.jsp response with a row for each day, newest first"""
+    rows = []
+    date = date_to
+    while date >= date_from:
+        rows.append("{},{},3.358,{},10416,3977,12:35,Fine,12.5,27.1,3400,5000,1300,700".format(
+            date.strftime("%Y%m%d"), 8000 + date.day * 100, 7000 + date.day * 90))
+        date -= datetime.timedelta(days=1)
+    return ";".join(rows)
+
+
+HISTORY_PAYLOAD = history_payload()
+OUTPUT_PAYLOAD = output_payload(datetime.date(2021, 2, 4), datetime.date(2021, 3, 5))
+
+
+def legacy_parse_history(content):
+    """The history parser PVOutput used before rows were parsed lazily"""
+    r = []
+    for data in [a.split(",") for a in content.split(";")]:
+        extended_values = data[11:] if len(data) > 11 else None
+        (date, time_, energy_generation, energy_efficiency, instantaneous_power, average_power,
+         normalised_output, energy_consumption, power_consumption, temperature, voltage) = data[:11]
+        r.append(HistoryStatus(datetime.datetime.strptime(date, "%Y%m%d").date(),
+                               datetime.datetime.strptime(time_, "%H:%M").time(), int(energy_generation),
+                               float(energy_efficiency), int(instantaneous_power), int(average_power),
+                               float(normalised_output),
+                               None if energy_consumption == "NaN" else int(energy_consumption),
+                               None if power_consumption == "NaN" else int(power_consumption),
+                               None if temperature == "NaN" else float(temperature),
+                               None if voltage == "NaN" else float(voltage), extended_values))
+    return r
+
+
+def allocations(function):
+    """:return: The peak traced memory in bytes during one call and the number of allocations it kept alive"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = function()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        del result
+        return peak, sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    finally:
+        tracemalloc.stop()
+
+
+def peak_memory(function):
+    return allocations(function)[0]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers getstatus.jsp, getstatistic.jsp and getoutput.jsp like pvoutput.org does"""
+    protocol_version = "HTTP/1.1"  # allows keep-alive
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def payload(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if url.path.endswith("getstatistic.jsp"):
+            return STATISTIC_PAYLOAD
+        if url.path.endswith("getoutput.jsp"):
+            return OUTPUT_PAYLOAD
+        if "stats" in params:
+            return DAY_STATISTICS_PAYLOAD
+        if "h" in params:
+            return HISTORY_PAYLOAD
+        if "ext" in params:
+            return EXTENDED_STATUS_PAYLOAD
+        return STATUS_PAYLOAD
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.payload().encode("utf-8")
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Rate-Limit-Remaining", "300")
+        self.send_header("X-Rate-Limit-Limit", "300")
+        self.send_header("X-Rate-Limit-Reset", str(int(time.time()) + 3600))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    def __init__(self, latency=0.0):
+        """
+        :param latency: Seconds to wait before answering each request, to simulate the network
+        """
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.connections = 0
+        self.server.requests = 0
+        self.server.latency = latency
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FreshHttpTransport(Transport):
+    """Creates a new httplib2.Http for every request, which is what PVOutput used to do"""
+
+    def request(self, method, uri, headers):
+        (response, content) = httplib2.Http().request(uri=uri, method=method, headers=headers)
+        return HttpResponse(int(response.status), dict(response)), content
+
+
+def time_calls(function, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return (time.perf_counter() - start) / count
+
+
+def latencies(function, count):
+    r = []
+    for _ in range(count):
+        start = time.perf_counter()
+        function()
+        r.append(time.perf_counter() - start)
+    return r
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[round(fraction * (len(values) - 1))]
+
+
+def benchmark_connection_reuse(results, calls, latency):
+    print("Connection reuse ({} calls to get_status)".format(calls))
+    for name, transport in (("fresh Http per call", FreshHttpTransport()), ("pooled", Httplib2Transport())):
+        with StubServer(latency) as server:
+            pvo = PVOutput(system_id=1, api_key="key", host=server.host, transport=transport)
+            per_call = time_calls(pvo.get_status, calls)
+            pvo.close()
+            print("  {:<20} {:8.3f} ms/call {:6d} connections".format(name, per_call * 1000, server.connections))
+            results[name] = {"ms_per_call": per_call * 1000, "connections": server.connections}
+
+
+def benchmark_cache(results, calls, latency):
+    print("Response cache ({} calls to get_status)".format(calls))
+    for name, cache in (("no cache", None), ("cache", ResponseCache())):
+        with StubServer(latency) as server:
+            pvo = PVOutput(system_id=1, api_key="key", host=server.host, cache=cache)
+            per_call = time_calls(pvo.get_status, calls)
+            pvo.close()
+            print("  {:<20} {:8.3f} ms/call {:6d} requests".format(name, per_call * 1000, server.requests))
+            results[name] = {"ms_per_call": per_call * 1000, "requests": server.requests}
+
+
+def benchmark_round_trips(results, calls, latency):
+    print("Round trips ({} uncached calls each)".format(calls))
+    print("  {:<20} {:>8} {:>8} {:>8} {:>8}".format("", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    date = datetime.date(2021, 3, 5)
+    with StubServer(latency) as server:
+        pvo = PVOutput(system_id=1, api_key="key", host=server.host)
+        for name, function in (
+                ("status", lambda: pvo.get_status()),
+                ("status extended", lambda: pvo.get_status(extended_data=True)),
+                ("day statistics", lambda: pvo.get_status(date=date, day_statistics=True)),
+                ("history", lambda: pvo.get_status(date=date, history=True, extended_data=True)),
+                ("history columnar", lambda: pvo.get_status(date=date, history=True, columnar=True)),
+                ("statistic", lambda: pvo.get_statistic(consumption_and_import=True, credits_debits=True)),
+                ("output", lambda: pvo.get_output(date_from=date - datetime.timedelta(days=29), date_to=date))):
+            function()  # opens the connection so it isn't counted in the first sample
+            values = [value * 1000 for value in latencies(function, calls)]
+            row = {"p50": percentile(values, 0.5), "p90": percentile(values, 0.9), "p99": percentile(values, 0.99),
+                   "max": max(values), "mean": statistics.mean(values)}
+            print("  {:<20} {p50:8.3f} {p90:8.3f} {p99:8.3f} {max:8.3f}".format(name, **row))
+            results[name] = row
+        pvo.close()
+
+
+def benchmark_parsing(results, calls, latency):
+    print("Parsing ({} calls each)".format(calls))
+    print("  {:<20} {:>12} {:>10} {:>8}".format("", "calls/s", "peak KiB", "kept"))
+    for name, function in (
+            ("status", lambda: parse_status(STATUS_PAYLOAD)),
+            ("status extended", lambda: parse_status(EXTENDED_STATUS_PAYLOAD)),
+            ("day statistics", lambda: parse_day_statistics(DAY_STATISTICS_PAYLOAD)),
+            ("history", lambda: parse_history(HISTORY_PAYLOAD)),
+            ("history columnar", lambda: parse_history_columns(HISTORY_PAYLOAD)),
+            ("statistic", lambda: parse_statistic(STATISTIC_PAYLOAD, True, True)),
+            ("output", lambda: parse_outputs(OUTPUT_PAYLOAD))):
+        per_call = time_calls(function, calls)
+        (peak, kept) = allocations(function)
+        print("  {:<20} {:12.0f} {:10.1f} {:8d}".format(name, 1 / per_call, peak / 1024, kept))
+        results[name] = {"calls_per_second": 1 / per_call, "peak_bytes": peak, "allocations_kept": kept}
+
+
+def benchmark_history_parsing(results, calls, latency, days=30):
+    content = history_payload(days=days)
+    rows = len(legacy_parse_history(content))
+    print("History parsing ({} rows)".format(rows))
+
+    def consume_lazily():
+        # an aggregation that never holds all rows at once
+        return sum(status.energy_generation for status in iter_history(content))
+
+    for name, function in (("legacy", lambda: legacy_parse_history(content)),
+                           ("parse_history", lambda: parse_history(content)),
+                           ("iter_history", consume_lazily),
+                           ("parse_history_columns", lambda: parse_history_columns(content))):
+        per_call = time_calls(function, 5)
+        peak = peak_memory(function)
+        print("  {:<22} {:10.0f} rows/s {:8.1f} KiB peak".format(name, rows / per_call, peak / 1024))
+        results[name] = {"rows_per_second": rows / per_call, "peak_bytes": peak}
+
+
+def benchmark_history_columns(results, calls, latency, days=30):
+    content = history_payload(days=days)
+    statuses = parse_history(content)
+    columns = parse_history_columns(content)
+    print("History analytics ({} rows, ms per call)".format(len(statuses)))
+    print("  {:<12} {:>14} {:>14} {:>14}".format("", "HistoryStatus", "columns", "columns numpy"))
+
+    def list_peak():
+        best = max(statuses, key=lambda status: status.instantaneous_power)
+        return best.instantaneous_power, datetime.datetime.combine(best.date, best.time)
+
+    def list_integrate():
+        total = 0.0
+        for a, b in zip(statuses, statuses[1:]):
+            seconds = abs((datetime.datetime.combine(b.date, b.time) -
+                           datetime.datetime.combine(a.date, a.time)).total_seconds())
+            total += (a.instantaneous_power + b.instantaneous_power) / 2 * seconds
+        return total / 3600
+
+    for name, list_function in (
+            ("sum", lambda: sum(status.instantaneous_power for status in statuses)),
+            ("mean", lambda: sum(status.temperature for status in statuses) / len(statuses)),
+            ("peak", list_peak),
+            ("integrate", list_integrate)):
+        column = "temperature" if name == "mean" else "instantaneous_power"
+        row = {"list": time_calls(list_function, calls) * 1000}
+        for key, use_numpy in (("columns", False), ("numpy", True)):
+            HistoryColumns.use_numpy = use_numpy
+            getattr(columns, name)(column)  # warm up, the first numpy call imports it
+            row[key] = time_calls(lambda: getattr(columns, name)(column), calls) * 1000
+        HistoryColumns.use_numpy = True
+        print("  {:<12} {list:14.3f} {columns:14.3f} {numpy:14.3f}".format(name, **row))
+        results[name] = row
+
+
+IMPORT_TIME_SCRIPT = """
+import importlib.util, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+if sys.argv[2] == "skill":
+    spec = importlib.util.spec_from_file_location("pvoutput_skill", sys.argv[1] + "/__init__.py",
+                                                  submodule_search_locations=[sys.argv[1]])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+else:
+    importlib.import_module(sys.argv[2])
+print(time.perf_counter() - start)
+"""
+DEFERRED_MODULES = ("pvoutput", "pytz", "mycroft.util.parse", "mycroft.util.format")
+"""Modules the skill imports when they are first needed instead of while it loads"""
+
+
+def import_time(module, runs=5):
+    """:return: The median number of seconds it takes a new interpreter to import module, or None if it can't"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, "-c", IMPORT_TIME_SCRIPT, directory, module],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        if process.returncode != 0:
+            return None
+        times.append(float(process.stdout))
+    return statistics.median(times)
+
+
+def benchmark_startup(results, calls, latency):
+    print("Startup (median import time in a new interpreter)")
+    for module in ("skill",) + DEFERRED_MODULES:
+        seconds = import_time(module)
+        if seconds is None:
+            print("  {:<22} {:>10}".format(module, "not installed"))
+        else:
+            print("  {:<22} {:10.1f} ms{}".format(module, seconds * 1000,
+                                                  "" if module == "skill" else " deferred"))
+        results[module] = None if seconds is None else {"ms": seconds * 1000}
+
+    def build_client():
+        PVOutput(system_id=1, api_key="key", cache=ResponseCache()).close()
+    per_call = time_calls(build_client, calls)
+    print("  {:<22} {:10.3f} ms each, now paid once instead of per intent".format("client construction",
+                                                                                 per_call * 1000))
+    results["client construction"] = {"ms": per_call * 1000}
+
+
+BENCHMARKS = {
+    "connections": benchmark_connection_reuse,
+    "cache": benchmark_cache,
+    "round_trips": benchmark_round_trips,
+    "parsing": benchmark_parsing,
+    "history": benchmark_history_parsing,
+    "columns": benchmark_history_columns,
+    "startup": benchmark_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the PVOutput client against a local stub server")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help="Any of {}. Runs all of them by default".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--calls", type=int, default=200, help="The number of calls to time in each benchmark")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Milliseconds the stub server waits before answering, to simulate the network")
+    parser.add_argument("--json", help="A file to save the results to")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark: {}".format(", ".join(sorted(unknown))))
+
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        results[name] = {}
+        BENCHMARKS[name](results[name], args.calls, args.latency / 1000)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,19 @@
+import array
+import calendar
+import contextlib
 import datetime
+import functools
+import itertools
+import math
+import queue
+import random
+import sqlite3
+import threading
+import time
 import urllib.parse
-from collections import namedtuple
-from typing import Optional, List, Union
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor, Future
+from typing import Optional, List, Union, Tuple, Iterator, Iterable, Dict, Callable
 
 import httplib2
 
@@ -13,6 +25,21 @@ your own project and keep this comment block
 retrodaredevil
 """
 
+
+class _ExtendedValues:
+    """Lets statuses access their extended values by number"""
+    __slots__ = ()
+
+    def extended_value(self, number: int) -> Optional[float]:
+        """
+        :param number: The number of the extended value, from 7 to 12, like v7 to v12 in the API
+        :return: The value, or None if it isn't set
+        """
+        values = self.extended_values
+        index = number - 7
+        return values[index] if values is not None and 0 <= index < len(values) else None
+
+
 DayStatisticsStandard = namedtuple("DayStatisticsStandard",
                                    "energy_generation power_generation peak_power peak_power_time")
 DayStatisticsOwner = namedtuple("DayStatisticsOwner",
@@ -21,12 +48,30 @@ DayStatisticsTemperature = namedtuple("DayStatisticsTemperature",
                                       "temperature_min temperature_max temperature_average")
 DayStatistics = namedtuple("DayStatistics", "standard owner temperature")
 
-HistoryStatus = namedtuple("HistoryStatus", "date time energy_generation energy_efficiency instantaneous_power "
-                                            "average_power normalised_output energy_consumption power_consumption "
-                                            "temperature voltage extended_values")
 
-GetStatus = namedtuple("GetStatus", "date time energy_generation power_generation energy_consumption power_consumption "
-                                    "normalised_output temperature voltage extended_values")
+class HistoryStatus(_ExtendedValues, namedtuple("HistoryStatus",
+                                                "date time energy_generation energy_efficiency instantaneous_power "
+                                                "average_power normalised_output energy_consumption power_consumption "
+                                                "temperature voltage extended_values")):
+    """extended_values is a tuple of v7 to v12 as floats, with None for values that aren't set, or None"""
+    __slots__ = ()
+
+
+class GetStatus(_ExtendedValues, namedtuple("GetStatus",
+                                            "date time energy_generation power_generation energy_consumption "
+                                            "power_consumption normalised_output temperature voltage extended_values")):
+    """extended_values is a tuple of v7 to v12 as floats, with None for values that aren't set, or None"""
+    __slots__ = ()
+
+
+Output = namedtuple("Output", "date energy_generated efficiency energy_exported energy_used peak_power peak_time "
+                              "condition temperature_min temperature_max peak_energy_import off_peak_energy_import "
+                              "shoulder_energy_import high_shoulder_energy_import")
+
+HttpResponse = namedtuple("HttpResponse", "status headers")
+
+_DayHistory = Tuple[Optional[int], datetime.date, List[HistoryStatus]]
+"""A system id, a date and the statuses of that day, as yielded by :meth:`PVOutput.backfill_history`"""
 
 Statistic = namedtuple("Statistic",
                        "energy_generated energy_exported average_generation minimum_generation maximum_generation "
@@ -40,7 +85,11 @@ def to_pvoutput_time(time: datetime.time):
     return time.strftime("%H:%M")
 
 
+@functools.lru_cache(maxsize=2048)
 def from_pvoutput_time(time: str):
+    # There are only 1440 minutes in a day, so parsed times are memoized. Slicing is much faster than strptime
+    if len(time) == 5 and time[2] == ":":
+        return datetime.time(int(time[:2]), int(time[3:]))
     return datetime.datetime.strptime(time, "%H:%M").time()
 
 
@@ -48,10 +97,238 @@ def to_pvoutput_date(date: datetime.date):
     return date.strftime("%Y%m%d")
 
 
+@functools.lru_cache(maxsize=1024)
 def from_pvoutput_date(date: str):
+    if len(date) == 8:
+        return datetime.date(int(date[:4]), int(date[4:6]), int(date[6:]))
     return datetime.datetime.strptime(date, "%Y%m%d").date()
 
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+HISTORY_PAGE_SIZE = 288
+"""The maximum number of statuses getstatus.jsp returns in one history request"""
+
+OUTPUT_PAGE_SIZE = 50
+"""The maximum number of days getoutput.jsp returns in one request"""
+
+
+@functools.lru_cache(maxsize=None)
+def _import_numpy():
+    """:return: The numpy module, or None if it isn't installed. numpy is optional, so this is only tried once"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class HistoryColumns:
+    """
+    History statuses stored as one typed array per field instead of one :class:`HistoryStatus` per row.
+    Every column is an ``array.array("d")`` and missing ("NaN") values are stored as ``math.nan``.
+
+    ``timestamps`` holds seconds since the epoch of each row's date and time. PVOutput reports times in the system's
+    local timezone, so the timestamps treat that local time as if it were UTC.
+    """
+    COLUMNS = ("timestamps", "energy_generation", "energy_efficiency", "instantaneous_power", "average_power",
+               "normalised_output", "energy_consumption", "power_consumption", "temperature", "voltage")
+    use_numpy = True
+    """Whether sum, mean, peak and integrate use numpy when it is installed, instead of looping in Python"""
+
+    def __init__(self):
+        for name in self.COLUMNS:
+            setattr(self, name, array.array("d"))
+        self.extended_values: List[array.array] = []
+        """A column for each extended value (v7 to v12) that was present"""
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def copy(self) -> "HistoryColumns":
+        r = HistoryColumns()
+        for name in self.COLUMNS:
+            setattr(r, name, array.array("d", getattr(self, name)))
+        r.extended_values = [array.array("d", column) for column in self.extended_values]
+        return r
+
+    def datetime_at(self, index: int) -> datetime.datetime:
+        return _EPOCH + datetime.timedelta(seconds=self.timestamps[index])
+
+    def _numpy_column(self, column: str):
+        """:return: The column as a numpy array without copying it, or None to use the pure Python helpers"""
+        values = getattr(self, column)
+        numpy = _import_numpy() if self.use_numpy and values else None
+        return None if numpy is None else numpy.frombuffer(values, dtype=numpy.float64)
+
+    def sum(self, column: str) -> float:
+        """:return: The sum of the column, ignoring missing values"""
+        values = self._numpy_column(column)
+        if values is not None:
+            return float(_import_numpy().nansum(values))
+        return math.fsum(value for value in getattr(self, column) if value == value)
+
+    def mean(self, column: str) -> Optional[float]:
+        """:return: The mean of the column ignoring missing values, or None if there are no values"""
+        values = self._numpy_column(column)
+        if values is not None:
+            numpy = _import_numpy()
+            count = len(values) - int(numpy.count_nonzero(numpy.isnan(values)))
+            return float(numpy.nansum(values)) / count if count else None
+        values = [value for value in getattr(self, column) if value == value]
+        if not values:
+            return None
+        return math.fsum(values) / len(values)
+
+    def peak(self, column: str) -> Optional[Tuple[float, datetime.datetime]]:
+        """:return: The largest value in the column and the time it happened at, or None if there are no values"""
+        array_values = self._numpy_column(column)
+        if array_values is not None:
+            numpy = _import_numpy()
+            if numpy.isnan(array_values).all():
+                return None
+            best = int(numpy.nanargmax(array_values))
+            return float(array_values[best]), self.datetime_at(best)
+        values = getattr(self, column)
+        best = None
+        for index, value in enumerate(values):
+            if value == value and (best is None or value > values[best]):
+                best = index
+        if best is None:
+            return None
+        return values[best], self.datetime_at(best)
+
+    def integrate(self, column: str) -> float:
+        """
+        Integrates the column over time using the trapezoidal rule, skipping intervals with missing values.
+        Integrating a column in watts gives watt hours.
+        """
+        array_values = self._numpy_column(column)
+        if array_values is not None:
+            numpy = _import_numpy()
+            intervals = numpy.abs(numpy.diff(numpy.frombuffer(self.timestamps, dtype=numpy.float64)))
+            areas = (array_values[1:] + array_values[:-1]) / 2 * intervals
+            return float(numpy.nansum(areas)) / 3600
+        timestamps = self.timestamps
+        values = getattr(self, column)
+        total = 0.0
+        for i in range(1, len(values)):
+            a = values[i - 1]
+            b = values[i]
+            if a == a and b == b:
+                total += (a + b) / 2 * abs(timestamps[i] - timestamps[i - 1])
+        return total / 3600
+
+    def to_numpy(self) -> dict:
+        """
+        :return: A dictionary of column name to numpy array. numpy is not a requirement of this skill,
+                 so this raises ImportError when it is not installed.
+        """
+        import numpy
+        r = {name: numpy.frombuffer(getattr(self, name), dtype=numpy.float64) for name in self.COLUMNS}
+        for i, column in enumerate(self.extended_values):
+            r["v{}".format(7 + i)] = numpy.frombuffer(column, dtype=numpy.float64)
+        return r
+
+
+class OutputAggregate(namedtuple("OutputAggregate",
+                                 "outputs energy_generated minimum_generation maximum_generation energy_exported "
+                                 "efficiency_sum record_efficiency record_date date_from date_to consumption_outputs "
+                                 "energy_consumed minimum_consumption maximum_consumption peak_energy_import "
+                                 "off_peak_energy_import shoulder_energy_import high_shoulder_energy_import")):
+    """
+    Totals of a set of daily outputs. Aggregates of separate periods can be combined with
+    :func:`combine_output_aggregates`, which is how the store answers long periods from monthly and yearly rollups.
+    """
+    __slots__ = ()
+
+    def to_statistic(self, consumption_and_import: bool) -> Statistic:
+        """:return: The same statistic getstatistic.jsp would give for these outputs, without credits and debits"""
+        outputs = self.outputs
+        consumption_outputs = self.consumption_outputs
+        # like getstatistic.jsp, consumption is 0 rather than missing when no output has energy used
+        return Statistic(
+            self.energy_generated, self.energy_exported, int(round(self.energy_generated / outputs)),
+            self.minimum_generation, self.maximum_generation, round(self.efficiency_sum / outputs, 3), outputs,
+            self.date_from, self.date_to, self.record_efficiency, self.record_date,
+            self.energy_consumed if consumption_and_import else None,
+            self.peak_energy_import if consumption_and_import else None,
+            self.off_peak_energy_import if consumption_and_import else None,
+            self.shoulder_energy_import if consumption_and_import else None,
+            self.high_shoulder_energy_import if consumption_and_import else None,
+            (int(round(self.energy_consumed / consumption_outputs)) if consumption_outputs else 0)
+            if consumption_and_import else None,
+            (self.minimum_consumption or 0) if consumption_and_import else None,
+            (self.maximum_consumption or 0) if consumption_and_import else None,
+            None, None
+        )
+
+
+EMPTY_OUTPUT_AGGREGATE = OutputAggregate(0, 0, None, None, 0, 0.0, None, None, None, None, 0, 0, None, None,
+                                         0, 0, 0, 0)
+
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def _is_record(r: OutputAggregate, efficiency: float, date: datetime.date) -> bool:
+    """
+    :return: True if efficiency beats the record of r. Like the store, a missing efficiency counts as 0.0 and ties
+             go to the earlier date
+    """
+    return (r.record_efficiency is None or efficiency > r.record_efficiency or
+            (efficiency == r.record_efficiency and date < r.record_date))
+
+
+def aggregate_outputs(outputs: Iterable[Output]) -> OutputAggregate:
+    r = EMPTY_OUTPUT_AGGREGATE
+    for output in outputs:
+        record = _is_record(r, output.efficiency or 0.0, output.date)
+        used = output.energy_used
+        r = OutputAggregate(
+            r.outputs + 1, r.energy_generated + (output.energy_generated or 0),
+            _min(r.minimum_generation, output.energy_generated), _max(r.maximum_generation, output.energy_generated),
+            r.energy_exported + (output.energy_exported or 0), r.efficiency_sum + (output.efficiency or 0.0),
+            (output.efficiency or 0.0) if record else r.record_efficiency, output.date if record else r.record_date,
+            _min(r.date_from, output.date), _max(r.date_to, output.date),
+            r.consumption_outputs + (used is not None), r.energy_consumed + (used or 0),
+            _min(r.minimum_consumption, used), _max(r.maximum_consumption, used),
+            r.peak_energy_import + (output.peak_energy_import or 0),
+            r.off_peak_energy_import + (output.off_peak_energy_import or 0),
+            r.shoulder_energy_import + (output.shoulder_energy_import or 0),
+            r.high_shoulder_energy_import + (output.high_shoulder_energy_import or 0)
+        )
+    return r
+
+
+def combine_output_aggregates(aggregates: Iterable[OutputAggregate]) -> OutputAggregate:
+    r = EMPTY_OUTPUT_AGGREGATE
+    for a in aggregates:
+        if a.outputs == 0:
+            continue
+        # rollups stored before missing efficiencies counted as 0.0 have no record efficiency when all were missing
+        efficiency = a.record_efficiency or 0.0
+        record = _is_record(r, efficiency, a.record_date)
+        r = OutputAggregate(
+            r.outputs + a.outputs, r.energy_generated + a.energy_generated,
+            _min(r.minimum_generation, a.minimum_generation), _max(r.maximum_generation, a.maximum_generation),
+            r.energy_exported + a.energy_exported, r.efficiency_sum + a.efficiency_sum,
+            efficiency if record else r.record_efficiency, a.record_date if record else r.record_date,
+            _min(r.date_from, a.date_from), _max(r.date_to, a.date_to),
+            r.consumption_outputs + a.consumption_outputs, r.energy_consumed + a.energy_consumed,
+            _min(r.minimum_consumption, a.minimum_consumption), _max(r.maximum_consumption, a.maximum_consumption),
+            r.peak_energy_import + a.peak_energy_import, r.off_peak_energy_import + a.off_peak_energy_import,
+            r.shoulder_energy_import + a.shoulder_energy_import,
+            r.high_shoulder_energy_import + a.high_shoulder_energy_import
+        )
+    return r
+
+
 class PVOutputException(Exception):
     def __init__(self, message):
         super().__init__(message)
@@ -82,33 +359,759 @@ class InvalidApiKeyPVOutputException(UnauthorizedPVOutputException):
         super().__init__(message)
 
 
+class RateLimitExceededPVOutputException(PVOutputException):
+    def __init__(self, message, reset_time: Optional[datetime.datetime] = None):
+        """
+        :param reset_time: The time that more requests can be made, if known
+        """
+        super().__init__(message)
+        self.reset_time = reset_time
+
+
+class ServiceUnavailablePVOutputException(PVOutputException):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class Transport:
+    """
+    Sends requests to pvoutput.org. A transport is owned by a :class:`PVOutput` and lives as long as it does,
+    so implementations are expected to keep connections alive between requests.
+    """
+
+    def request(self, method: str, uri: str, headers: dict) -> Tuple[HttpResponse, bytes]:
+        """
+        Implementations should pass the time spent opening connections to :func:`record_connect_time`, otherwise
+        it is counted as transfer time.
+
+        :raises OSError: If the request fails because of the network, including timeouts
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+def record_connect_time(seconds: float):
+    """Called by transports with the number of seconds spent connecting (TCP and TLS) during a request"""
+    _request_context.connect_time = getattr(_request_context, "connect_time", 0.0) + seconds
+
+
+class _TimedHTTPConnection(httplib2.HTTPConnectionWithTimeout):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_connect_time(time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(httplib2.HTTPSConnectionWithTimeout):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_connect_time(time.perf_counter() - start)
+
+
+class Httplib2Transport(Transport):
+    """
+    The default transport. Keeps a pool of :class:`httplib2.Http` objects, each of which holds its keep-alive
+    connections open, so requests after the first one skip the TCP and TLS handshake.
+    A single :class:`httplib2.Http` is not thread safe, so each request borrows one from the pool.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_connections: int = 4):
+        self.__timeout = timeout
+        self.__pool = queue.LifoQueue(maxsize=max_connections)
+
+    def _acquire(self) -> httplib2.Http:
+        try:
+            return self.__pool.get_nowait()
+        except queue.Empty:
+            return httplib2.Http(timeout=self.__timeout)
+
+    def _release(self, http: httplib2.Http):
+        try:
+            self.__pool.put_nowait(http)
+        except queue.Full:
+            http.close()
+
+    def request(self, method: str, uri: str, headers: dict) -> Tuple[HttpResponse, bytes]:
+        http = self._acquire()
+        try:
+            connection_type = _TimedHTTPSConnection if uri.startswith("https:") else _TimedHTTPConnection
+            (response, content) = http.request(uri=uri, method=method, headers=headers,
+                                               connection_type=connection_type)
+        except Exception:
+            http.close()  # the connection may be in a bad state, so don't give it back to the pool
+            raise
+        self._release(http)
+        return HttpResponse(int(response.status), dict(response)), content
+
+    def close(self):
+        while True:
+            try:
+                self.__pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class HttpxTransport(Transport):
+    """
+    A transport backed by httpx, which is able to use HTTP/2 when the h2 package is installed.
+    httpx is not a requirement of this skill, so it is only imported when this transport is used.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, http2: bool = True, max_connections: int = 4):
+        import httpx
+        self.__client = httpx.Client(timeout=timeout, http2=http2,
+                                     limits=httpx.Limits(max_connections=max_connections,
+                                                         max_keepalive_connections=max_connections))
+
+    def request(self, method: str, uri: str, headers: dict) -> Tuple[HttpResponse, bytes]:
+        import httpx
+        started = {}
+
+        def trace(event_name: str, info: dict):
+            # httpcore reports connection.connect_tcp.started/complete and connection.start_tls.started/complete
+            (name, _, step) = event_name.rpartition(".")
+            if name in ("connection.connect_tcp", "connection.start_tls"):
+                if step == "started":
+                    started[name] = time.perf_counter()
+                elif step in ("complete", "failed") and name in started:
+                    record_connect_time(time.perf_counter() - started.pop(name))
+        try:
+            response = self.__client.request(method, uri, headers=headers, extensions={"trace": trace})
+        except httpx.TransportError as e:
+            raise OSError(str(e)) from e
+        return HttpResponse(response.status_code, {k.lower(): v for k, v in response.headers.items()}), \
+            response.content
+
+    def close(self):
+        self.__client.close()
+
+
+class ResponseCache:
+    """
+    A thread safe LRU cache of parsed responses. Results for dates that can no longer change are kept until they are
+    evicted, everything else expires after the TTL of its endpoint.
+    """
+
+    def __init__(self, max_entries: int = 128, status_ttl: float = 60.0, statistic_ttl: float = 300.0):
+        """
+        :param max_entries: The maximum number of responses to keep in memory
+        :param status_ttl: The number of seconds a live getstatus result is kept for
+        :param statistic_ttl: The number of seconds a getstatistic result that includes today is kept for
+        """
+        self.max_entries = max_entries
+        self.status_ttl = status_ttl
+        self.statistic_ttl = statistic_ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, max_age: Optional[float] = None):
+        """
+        :param max_age: If set, a value that was put more than this many seconds ago is treated as missing
+        :return: The cached value or None if there is no value or it has expired
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            (expires, put_time, value) = entry
+            now = time.monotonic()
+            if expires is not None and expires <= now:
+                # expired values are left for get_stale until they are evicted
+                return None
+            if max_age is not None and now - put_time > max_age:
+                return None
+            self.__entries.move_to_end(key)
+            return value
+
+    def get_stale(self, key):
+        """
+        :return: The cached value even if it has expired, or None. This is used when pvoutput.org is unavailable
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return None if entry is None else entry[2]
+
+    def put(self, key, value, ttl: Optional[float]):
+        now = time.monotonic()
+        expires = None if ttl is None else now + ttl
+        with self.__lock:
+            self.__entries[key] = (expires, now, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class SingleFlight:
+    """
+    Makes concurrent calls with the same key share a single call, so identical requests that are made at the same
+    time only reach pvoutput.org once. Every caller gets the same result, or the same exception.
+    """
+
+    def __init__(self):
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, function):
+        with self.__lock:
+            future = self.__calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.__calls[key] = future
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+
+
+class RetryPolicy:
+    """
+    Decides how many times a failed GET request is retried and how long to wait between attempts.
+    Delays grow exponentially and are randomly shortened by up to jitter so that retries from many clients spread out.
+    """
+
+    def __init__(self, retries: int = 2, backoff: float = 0.5, max_backoff: float = 8.0, jitter: float = 0.5):
+        """
+        :param retries: The number of times a request is retried after the first attempt
+        :param backoff: The number of seconds to wait before the first retry
+        :param max_backoff: The maximum number of seconds to wait between attempts
+        :param jitter: The fraction of each delay that is random
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        """:return: The number of seconds to wait after the given attempt (starting at 0) fails"""
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+
+class CircuitBreaker:
+    """
+    Remembers that pvoutput.org is failing so requests fail fast instead of each waiting for a timeout.
+    After failure_threshold failures in a row the circuit opens and requests are refused for reset_timeout seconds.
+    Then a single request is let through, and the circuit closes again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.__failures = 0
+        self.__opened: Optional[float] = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self.__lock:
+            return self.__opened is not None
+
+    def allow(self) -> bool:
+        """:return: True if a request may be made"""
+        with self.__lock:
+            if self.__opened is None:
+                return True
+            if not self.__trial and time.monotonic() - self.__opened >= self.reset_timeout:
+                self.__trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened = None
+            self.__trial = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial or self.__failures >= self.failure_threshold:
+                self.__opened = time.monotonic()
+            self.__trial = False
+
+    def release_trial(self):
+        """
+        Called when a request that allow() let through ended without reaching pvoutput.org or failing because of it,
+        such as when the rate limiter refused it, so the next request can be the trial instead
+        """
+        with self.__lock:
+            self.__trial = False
+
+
+PRIORITY_INTERACTIVE = 0
+"""The priority of requests made because someone is waiting for an answer. This is the default"""
+PRIORITY_BACKGROUND = 1
+"""The priority of prefetches, syncs and backfills, which can wait and must leave some of the quota unused"""
+
+_request_context = threading.local()
+
+
+def get_request_priority() -> int:
+    """:return: The priority of requests made by the current thread"""
+    return getattr(_request_context, "priority", PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def request_priority(priority: int):
+    """
+    Sets the priority of requests made by the current thread inside the with block.
+
+    Example: ``with request_priority(PRIORITY_BACKGROUND): client.sync_outputs(...)``
+    """
+    previous = get_request_priority()
+    _request_context.priority = priority
+    try:
+        yield
+    finally:
+        _request_context.priority = previous
+
+
+def _bind_priority(function):
+    """:return: A function that calls the given function with the current thread's priority, on any thread"""
+    priority = get_request_priority()
+
+    def run(*args, **kwargs):
+        with request_priority(priority):
+            return function(*args, **kwargs)
+    return run
+
+
+class RateLimiter:
+    """
+    A thread safe token bucket that keeps requests under pvoutput.org's hourly request limit.
+
+    Until pvoutput.org reports the remaining quota, tokens refill continuously at the hourly rate. After a response
+    with X-Rate-Limit headers, the reported remaining count is used and the whole quota comes back at the reported
+    reset time, which is how pvoutput.org counts requests.
+
+    Background requests leave background_reserve of the quota for interactive requests and wait for tokens,
+    while interactive requests only wait a moment. When a request can't wait long enough,
+    :class:`RateLimitExceededPVOutputException` is raised instead.
+    """
+
+    def __init__(self, requests_per_hour: int = 60, background_reserve: float = 0.25,
+                 max_interactive_wait: float = 5.0, max_background_wait: float = 600.0):
+        """
+        :param requests_per_hour: The number of requests that may be made per hour until pvoutput.org tells us
+        :param background_reserve: The fraction of the quota that background requests can't use
+        :param max_interactive_wait: The number of seconds an interactive request may wait for a token
+        :param max_background_wait: The number of seconds a background request may wait for a token
+        """
+        self.capacity = requests_per_hour
+        self.background_reserve = background_reserve
+        self.max_interactive_wait = max_interactive_wait
+        self.max_background_wait = max_background_wait
+        self.__tokens = float(requests_per_hour)
+        self.__updated = time.monotonic()
+        self.__reset: Optional[float] = None
+        """The epoch time that the quota resets at, if pvoutput.org has told us"""
+        self.__lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        """:return: The number of requests that can be made right now"""
+        with self.__lock:
+            self._refill()
+            return int(self.__tokens)
+
+    @property
+    def reset_time(self) -> Optional[datetime.datetime]:
+        reset = self.__reset
+        return None if reset is None else datetime.datetime.fromtimestamp(reset, tz=datetime.timezone.utc)
+
+    def _refill(self):
+        # must be called while holding the lock
+        now = time.monotonic()
+        if self.__reset is not None:
+            if time.time() >= self.__reset:
+                self.__tokens = float(self.capacity)
+                self.__reset = None
+        else:
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.capacity / 3600.0)
+        self.__updated = now
+
+    def _wait_time(self, reserve: float) -> float:
+        # must be called while holding the lock
+        if self.__reset is not None:
+            return max(0.0, self.__reset - time.time())
+        return (reserve + 1 - self.__tokens) * 3600.0 / self.capacity
+
+    def acquire(self, priority: Optional[int] = None):
+        """
+        Blocks until a request may be made.
+
+        :param priority: The priority of the request. Defaults to the current thread's priority
+        :raises RateLimitExceededPVOutputException: If the request would have to wait too long
+        """
+        if priority is None:
+            priority = get_request_priority()
+        background = priority >= PRIORITY_BACKGROUND
+        max_wait = self.max_background_wait if background else self.max_interactive_wait
+        waited = 0.0
+        while True:
+            with self.__lock:
+                self._refill()
+                reserve = self.capacity * self.background_reserve if background else 0.0
+                if self.__tokens - reserve >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = self._wait_time(reserve)
+            if waited + wait > max_wait:
+                raise RateLimitExceededPVOutputException("Would exceed the hourly request limit", self.reset_time)
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, headers: dict):
+        """
+        Updates the quota from the X-Rate-Limit headers of a response
+
+        :param headers: The response headers with lower case names
+        """
+        remaining = headers.get("x-rate-limit-remaining")
+        if remaining is None:
+            return
+        limit = headers.get("x-rate-limit-limit")
+        reset = headers.get("x-rate-limit-reset")
+        with self.__lock:
+            if limit:
+                self.capacity = int(limit)
+            self.__tokens = float(remaining)
+            self.__reset = float(reset) if reset else None
+            self.__updated = time.monotonic()
+
+    def exhaust(self, reset_time: Optional[datetime.datetime]):
+        """Called when pvoutput.org says the limit has been exceeded, so no more requests are made until reset_time"""
+        with self.__lock:
+            self.__tokens = 0.0
+            if reset_time is not None:
+                self.__reset = reset_time.timestamp()
+
+
+class RequestMetrics:
+    """
+    Describes one call that needed a response from pvoutput.org, whether or not a request was actually sent.
+    These are passed to the hooks of a :class:`PVOutput` once the call is done. Times are in seconds.
+
+    cache is "hit" when the result came from the cache, "miss" when it didn't, "stale" when pvoutput.org was
+    unavailable and an expired result was used instead and None when the call doesn't use the cache.
+    shared is True when an identical call on another thread made the request and this call used its result.
+    """
+
+    def __init__(self, system_id: int, endpoint: str, params: dict):
+        self.system_id = system_id
+        self.endpoint = endpoint
+        self.params = params
+        self.cache: Optional[str] = None
+        self.shared = False
+        self.requests = 0
+        """The number of requests that were sent, including retries"""
+        self.status: Optional[int] = None
+        """The HTTP status of the last response"""
+        self.wait_time = 0.0
+        """Time spent waiting for the rate limiter"""
+        self.connect_time = 0.0
+        self.transfer_time = 0.0
+        self.parse_time = 0.0
+        self.total_time = 0.0
+        self.rate_limit_remaining: Optional[int] = None
+        self.error: Optional[str] = None
+        """The name of the exception the call raised, if any"""
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.requests - 1)
+
+    def __repr__(self):
+        return "RequestMetrics({})".format(", ".join("{}={!r}".format(name, value)
+                                                     for name, value in vars(self).items()))
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    A thread safe hook that aggregates :class:`RequestMetrics` from any number of clients and exports them
+    in the Prometheus text format.
+
+    Example: ``registry = MetricsRegistry(); client = PVOutput(..., hooks=[registry]); registry.to_prometheus()``
+    """
+    PHASES = ("wait", "connect", "transfer", "parse", "total")
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.__calls: Dict[Tuple[str, str, str], int] = {}
+        """A map of (endpoint, cache, outcome) to the number of calls"""
+        self.__requests: Dict[str, int] = {}
+        self.__retries: Dict[str, int] = {}
+        self.__durations: Dict[Tuple[str, str], list] = {}
+        """A map of (endpoint, phase) to the count of each bucket followed by the sum and the total count"""
+        self.__rate_limit_remaining: Dict[int, int] = {}
+        self.__lock = threading.Lock()
+
+    def __call__(self, metrics: RequestMetrics):
+        self.record(metrics)
+
+    def record(self, metrics: RequestMetrics):
+        endpoint = metrics.endpoint
+        key = (endpoint, metrics.cache or "none", metrics.error or "ok")
+        with self.__lock:
+            self.__calls[key] = self.__calls.get(key, 0) + 1
+            if metrics.rate_limit_remaining is not None:
+                self.__rate_limit_remaining[metrics.system_id] = metrics.rate_limit_remaining
+            if not metrics.requests:
+                return  # durations only describe calls that went to pvoutput.org
+            self.__requests[endpoint] = self.__requests.get(endpoint, 0) + metrics.requests
+            self.__retries[endpoint] = self.__retries.get(endpoint, 0) + metrics.retries
+            for phase in self.PHASES:
+                value = getattr(metrics, phase + "_time")
+                histogram = self.__durations.get((endpoint, phase))
+                if histogram is None:
+                    histogram = self.__durations[(endpoint, phase)] = [0] * len(self.buckets) + [0.0, 0]
+                for i, bound in enumerate(self.buckets):
+                    if value <= bound:
+                        histogram[i] += 1
+                histogram[-2] += value
+                histogram[-1] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__calls.clear()
+            self.__requests.clear()
+            self.__retries.clear()
+            self.__durations.clear()
+            self.__rate_limit_remaining.clear()
+
+    def to_prometheus(self, prefix: str = "pvoutput") -> str:
+        """:return: Every metric in the Prometheus text exposition format"""
+        lines = []
+
+        def header(name: str, metric_type: str, help_text: str):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, metric_type))
+
+        def sample(name: str, labels: dict, value):
+            label_text = ",".join('{}="{}"'.format(k, _escape_label(v)) for k, v in labels.items())
+            lines.append("{}_{}{{{}}} {}".format(prefix, name, label_text, value))
+
+        with self.__lock:
+            header("calls_total", "counter", "Calls that needed a response, by cache result and outcome")
+            for (endpoint, cache, outcome), count in sorted(self.__calls.items()):
+                sample("calls_total", {"endpoint": endpoint, "cache": cache, "outcome": outcome}, count)
+            header("requests_total", "counter", "Requests sent to pvoutput.org, including retries")
+            for endpoint, count in sorted(self.__requests.items()):
+                sample("requests_total", {"endpoint": endpoint}, count)
+            header("retries_total", "counter", "Requests that were retries of a failed request")
+            for endpoint, count in sorted(self.__retries.items()):
+                sample("retries_total", {"endpoint": endpoint}, count)
+            header("request_duration_seconds", "histogram", "Time spent in each phase of calls that sent requests")
+            for (endpoint, phase), histogram in sorted(self.__durations.items()):
+                labels = {"endpoint": endpoint, "phase": phase}
+                for bound, count in zip(self.buckets, histogram):
+                    sample("request_duration_seconds_bucket", dict(labels, le=repr(float(bound))), count)
+                sample("request_duration_seconds_bucket", dict(labels, le="+Inf"), histogram[-1])
+                sample("request_duration_seconds_sum", labels, repr(histogram[-2]))
+                sample("request_duration_seconds_count", labels, histogram[-1])
+            header("rate_limit_remaining", "gauge", "Requests left in the hourly quota when last reported")
+            for system_id, remaining in sorted(self.__rate_limit_remaining.items()):
+                sample("rate_limit_remaining", {"system_id": system_id}, remaining)
+        return "\n".join(lines) + "\n"
+
+
+_TRANSIENT_ERRORS = (OSError, httplib2.HttpLib2Error)
+
+
 class PVOutput:
-    def __init__(self, system_id: int, api_key: str, host: str = "https://pvoutput.org"):
+    def __init__(self, system_id: int, api_key: str, host: str = "https://pvoutput.org",
+                 transport: Optional[Transport] = None, timeout: Optional[float] = None,
+                 cache: Optional[ResponseCache] = None, store: Optional["PVOutputStore"] = None,
+                 rate_limiter: Optional[RateLimiter] = None, retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 hooks: Iterable[Callable[[RequestMetrics], None]] = ()):
+        """
+        :param timeout: The number of seconds to wait for pvoutput.org. Only used when transport is not given
+        :param retry_policy: How failed GET requests are retried. Defaults to :class:`RetryPolicy`
+        :param circuit_breaker: Makes requests fail fast while pvoutput.org is down.
+                                Defaults to :class:`CircuitBreaker`
+        :param hooks: Called with the :class:`RequestMetrics` of every call that needs a response from pvoutput.org,
+                      on the thread that made the call. A :class:`MetricsRegistry` can be used as a hook
+        """
         self.__system_id = int(system_id)
         self.__api_key = "" + api_key
         self.__host = "" + host
+        self.__transport = transport or Httplib2Transport(timeout=timeout)
+        self.__cache = cache
+        self.__store = store
+        self.__rate_limiter = rate_limiter
+        self.__retry_policy = retry_policy or RetryPolicy()
+        self.__circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.__single_flight = SingleFlight()
+        self.__hooks = list(hooks)
         self.debug = False
 
-    def _send(self, method, path, params):
-        h = httplib2.Http()
-        # httplib2.debuglevel = 1
+    @property
+    def system_id(self) -> int:
+        return self.__system_id
+
+    @property
+    def api_key(self) -> str:
+        return self.__api_key
+
+    @property
+    def transport(self) -> Transport:
+        return self.__transport
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        return self.__cache
+
+    @property
+    def store(self) -> Optional["PVOutputStore"]:
+        return self.__store
+
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        return self.__rate_limiter
+
+    @property
+    def host(self) -> str:
+        return self.__host
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self.__retry_policy
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self.__circuit_breaker
+
+    @property
+    def hooks(self) -> List[Callable[[RequestMetrics], None]]:
+        """The instrumentation hooks. Hooks can be added to or removed from this list"""
+        return self.__hooks
+
+    @contextlib.contextmanager
+    def _instrument(self, path: str, params: dict):
+        """Measures a call inside the with block and passes the yielded :class:`RequestMetrics` to the hooks"""
+        metrics = RequestMetrics(self.__system_id, path.rpartition("/")[2], params)
+        start = time.perf_counter()
+        try:
+            yield metrics
+        except Exception as e:
+            metrics.error = type(e).__name__
+            raise
+        finally:
+            metrics.total_time = time.perf_counter() - start
+            for hook in self.__hooks:
+                hook(metrics)
+
+    def close(self):
+        self.__transport.close()
+
+    def _send(self, method, path, params, metrics: Optional[RequestMetrics] = None):
+        """
+        Sends a request, retrying GET requests that fail because of the network or a server error.
+
+        :raises ServiceUnavailablePVOutputException: If pvoutput.org could not be reached or keeps failing
+        """
+        breaker = self.__circuit_breaker
+        if not breaker.allow():
+            raise ServiceUnavailablePVOutputException("Not sending request because pvoutput.org is unavailable")
+        retries = self.__retry_policy.retries if method == "GET" else 0
+        attempt = 0
+        while True:
+            try:
+                (response, content) = self._send_once(method, path, params, metrics)
+            except _TRANSIENT_ERRORS as e:
+                failure = str(e) or type(e).__name__
+            except BaseException:
+                breaker.release_trial()
+                raise
+            else:
+                if response.status < 500:
+                    breaker.record_success()
+                    return response, content
+                failure = content
+            breaker.record_failure()
+            if attempt >= retries or not breaker.allow():
+                raise ServiceUnavailablePVOutputException(failure)
+            time.sleep(self.__retry_policy.delay(attempt))
+            attempt += 1
+
+    def _send_once(self, method, path, params, metrics: Optional[RequestMetrics] = None):
         headers = {
             "Content-type": "application/x-www-form-urlencoded",
             "Cache-Control": "no-store",
             "Accept": "text/plain",
             "X-Pvoutput-Apikey": self.__api_key,
-            "X-Pvoutput-SystemId": str(self.__system_id)
+            "X-Pvoutput-SystemId": str(self.__system_id),
+            "X-Rate-Limit": "1"
         }
         uri = urllib.parse.urljoin(self.__host, path)
         if params:
             uri += "?" + urllib.parse.urlencode(params)
-        (response, content) = h.request(uri=uri, method=method, headers=headers)
+        if metrics is None:
+            metrics = RequestMetrics(self.__system_id, path, params)  # measured, but not reported
+        rate_limiter = self._current_rate_limiter()
+        if rate_limiter is not None:
+            start = time.perf_counter()
+            rate_limiter.acquire()
+            metrics.wait_time += time.perf_counter() - start
+        metrics.requests += 1
+        _request_context.connect_time = 0.0
+        start = time.perf_counter()
+        try:
+            (response, content) = self.__transport.request(method, uri, headers)
+        finally:
+            connect_time = _request_context.connect_time
+            metrics.connect_time += connect_time
+            metrics.transfer_time += time.perf_counter() - start - connect_time
         if self.debug:
             print((response, content))
+        metrics.status = response.status
+        remaining = response.headers.get("x-rate-limit-remaining")
+        if remaining is not None:
+            metrics.rate_limit_remaining = int(remaining)
+        if rate_limiter is not None:
+            rate_limiter.update(response.headers)
+            if remaining is None:
+                metrics.rate_limit_remaining = rate_limiter.remaining
         return response, content.decode("utf-8")
 
-    @staticmethod
-    def _check_response(response, content):
+    def _current_rate_limiter(self) -> Optional[RateLimiter]:
+        """:return: This client's rate limiter, or the one a backfill set for the current thread if it has none"""
+        if self.__rate_limiter is not None:
+            return self.__rate_limiter
+        return getattr(_request_context, "rate_limiter", None)
+
+    def _check_response(self, response, content):
         status = int(response.status)
         if status == 401:
             if "Invalid API Key" in content:
@@ -119,14 +1122,71 @@ class PVOutput:
                 raise NoStatusPVOutputException(content)
             if "no outputs" in content:
                 raise NoOutputsPVOutputException(content)
+            if status == 403 and "Exceeded" in content:
+                reset = response.headers.get("x-rate-limit-reset")
+                reset_time = None if not reset else datetime.datetime.fromtimestamp(float(reset),
+                                                                                    tz=datetime.timezone.utc)
+                rate_limiter = self._current_rate_limiter()
+                if rate_limiter is not None:
+                    rate_limiter.exhaust(reset_time)
+                raise RateLimitExceededPVOutputException(content, reset_time)
 
             raise PVOutputException(content)
 
-    def get_status(self, date: Optional[datetime.date] = None, time: Optional[datetime.time] = None,
-                   history: bool = False, ascending: bool = False, limit: Optional[int] = None,
-                   time_from: Optional[datetime.time] = None, time_to: Optional[datetime.time] = None,
-                   extended_data: bool = False, system_id: Optional[int] = None,
-                   day_statistics: bool = False) -> Union[GetStatus, DayStatistics, List[HistoryStatus]]:
+    def _get(self, path: str, params: dict, parse, ttl: Optional[float] = None, result_type: str = "",
+             max_age: Optional[float] = None):
+        """
+        Sends a GET request and parses the response, using the cache if this client has one.
+
+        :param ttl: The number of seconds the parsed result can be cached for, or None if it never expires
+        :param result_type: Distinguishes different ways of parsing the same response in the cache
+        :param max_age: If set, cached results older than this many seconds are not used
+        """
+        with self._instrument(path, params) as metrics:
+            cache = self.__cache
+            key = (self.__system_id, path, tuple(sorted(params.items())), result_type)
+            if cache is not None:
+                cached = cache.get(key, max_age)
+                if cached is not None:
+                    metrics.cache = "hit"
+                    return cached
+                metrics.cache = "miss"
+
+            def request():
+                metrics.shared = False
+                (response, content) = self._send("GET", path, params, metrics)
+                self._check_response(response, content)
+                start = time.perf_counter()
+                result = parse(content)
+                metrics.parse_time = time.perf_counter() - start
+                if cache is not None:
+                    cache.put(key, result, ttl)
+                return result
+            metrics.shared = True
+            # a background request can wait minutes for a token, so interactive requests only share with each other
+            flight_key = key + (get_request_priority() >= PRIORITY_BACKGROUND,)
+            try:
+                return self.__single_flight.do(flight_key, request)
+            except ServiceUnavailablePVOutputException:
+                stale = None if cache is None else cache.get_stale(key)
+                if stale is None:
+                    raise
+                metrics.cache = "stale"
+                return stale
+
+    def _is_final(self, date: Optional[datetime.date]) -> bool:
+        """
+        :return: True if data for the given date can no longer change. Since we don't know the system's timezone,
+                 a date is only considered final once it is at least two days old
+        """
+        return date is not None and date <= self._last_final_date()
+
+    @staticmethod
+    def _status_params(date: Optional[datetime.date] = None, time: Optional[datetime.time] = None,
+                       history: bool = False, ascending: bool = False, limit: Optional[int] = None,
+                       time_from: Optional[datetime.time] = None, time_to: Optional[datetime.time] = None,
+                       extended_data: bool = False, system_id: Optional[int] = None,
+                       day_statistics: bool = False) -> dict:
         params = {}
         if date:
             params["d"] = to_pvoutput_date(date)
@@ -148,72 +1208,53 @@ class PVOutput:
             params["sid1"] = str(system_id)
         if day_statistics:
             params["stats"] = "1"
+        return params
 
-        (response, content) = self._send("GET", "service/r2/getstatus.jsp", params)
-        self._check_response(response, content)
+    def get_status(self, date: Optional[datetime.date] = None, time: Optional[datetime.time] = None,
+                   history: bool = False, ascending: bool = False, limit: Optional[int] = None,
+                   time_from: Optional[datetime.time] = None, time_to: Optional[datetime.time] = None,
+                   extended_data: bool = False, system_id: Optional[int] = None,
+                   day_statistics: bool = False, columnar: bool = False,
+                   max_age: Optional[float] = None) -> Union[GetStatus, DayStatistics, List[HistoryStatus],
+                                                             HistoryColumns]:
+        """
+        :param columnar: When used with history, return a :class:`HistoryColumns` instead of a list
+        :param max_age: If set, cached results older than this many seconds are not used. 0 always makes a request
+        """
+        params = self._status_params(date=date, time=time, history=history, ascending=ascending, limit=limit,
+                                     time_from=time_from, time_to=time_to, extended_data=extended_data,
+                                     system_id=system_id, day_statistics=day_statistics)
+        cache = self.__cache
+        store = self.__store
+        final = self._is_final(date)
+        ttl = None if cache is None or final else cache.status_ttl
         if day_statistics:
-            split_content = [a.split(",") for a in content.split(";")]
-            standard_content = split_content[0]
-            owner_content = None
-            temperature_content = None
-            if len(split_content) == 2:
-                if len(split_content[1]) == 4:
-                    owner_content = split_content[1]
-                else:
-                    temperature_content = split_content[1]
-            elif len(split_content) >= 3:
-                owner_content = split_content[1]
-                temperature_content = split_content[2]
-
-            (energy_generation, power_generation, peak_power, peak_power_time) = standard_content
-            standard = DayStatisticsStandard(int(energy_generation), int(power_generation), int(peak_power),
-                                             from_pvoutput_time(peak_power_time))
-            owner = None
-            temperature = None
-            if owner_content:
-                (energy_consumption, power_consumption, standby_power, standby_power_time) = owner_content
-                owner = DayStatisticsOwner(int(energy_consumption), int(power_consumption), int(standby_power),
-                                           from_pvoutput_time(standby_power_time))
-            if temperature_content:
-                (temperature_min, temperature_max, temperature_average) = temperature_content
-                temperature = DayStatisticsTemperature(float(temperature_min), float(temperature_max),
-                                                       float(temperature_average))
-
-            return DayStatistics(standard, owner, temperature)
+            if store is not None and final:
+                stored = store.get_day_statistics(system_id or self.__system_id, date)
+                if stored is not None:
+                    return stored
+            result = self._get("service/r2/getstatus.jsp", params, parse_day_statistics, ttl, max_age=max_age)
+            if store is not None and final:
+                # statistics of a day that isn't final can still grow, so they would be stored too early
+                store.put_day_statistics(system_id or self.__system_id, date, result)
+            return result
+        if history and columnar:
+            return self._get("service/r2/getstatus.jsp", params, parse_history_columns, ttl, "columnar",
+                             max_age).copy()
         if history:
-            split_data = [a.split(",") for a in content.split(";")]
-            r = []
-            for data in split_data:
-                standard_data = data[:11]
-                extended_values = None
-                if len(data) > 11:
-                    extended_values = data[11:]
-                (date, time, energy_generation, energy_efficiency, instantaneous_power, average_power,
-                 normalised_output, energy_consumption, power_consumption, temperature, voltage) = standard_data
-                r.append(HistoryStatus(from_pvoutput_date(date), from_pvoutput_time(time), int(energy_generation),
-                                       float(energy_efficiency), int(instantaneous_power), int(average_power),
-                                       float(normalised_output),
-                                       None if energy_consumption == "NaN" else int(energy_consumption),
-                                       None if power_consumption == "NaN" else int(power_consumption),
-                                       None if temperature == "NaN" else float(temperature),
-                                       None if voltage == "NaN" else float(voltage), extended_values))
-            return r
-
-        split = content.split(",")
-        standard_data = split[:9]
-        extended_values = None
-        if len(split) > 9:
-            extended_values = split[9:]
-        (date, time, energy_generation, power_generation, energy_consumption, power_consumption, normalised_output,
-         temperature, voltage) = standard_data
-        return GetStatus(from_pvoutput_date(date), from_pvoutput_time(time), int(energy_generation),
-                         int(power_generation), int(energy_consumption),
-                         int(power_consumption), float(normalised_output),
-                         None if temperature == "NaN" else float(temperature),
-                         None if voltage == "NaN" else float(voltage), extended_values)
+            # the cached list is shared, so give the caller their own copy
+            result = list(self._get("service/r2/getstatus.jsp", params, parse_history, ttl, max_age=max_age))
+            if store is not None:
+                store.put_history(system_id or self.__system_id, result)
+            return result
+        return self._get("service/r2/getstatus.jsp", params, parse_status, ttl, max_age=max_age)
 
     def get_statistic(self, date_from: datetime.date = None, date_to: datetime.date = None,
-                      consumption_and_import: bool = False, credits_debits: bool = False, system_id: int = None):
+                      consumption_and_import: bool = False, credits_debits: bool = False, system_id: int = None,
+                      max_age: Optional[float] = None):
+        """
+        :param max_age: If set, cached results older than this many seconds are not used. 0 always makes a request
+        """
         params = {}
         if date_from:
             params["df"] = to_pvoutput_date(date_from)
@@ -225,32 +1266,962 @@ class PVOutput:
             params["crdr"] = "1"
         if system_id:
             params["sid1"] = str(system_id)
-        (response, content) = self._send("GET", "service/r2/getstatistic.jsp", params)
-        self._check_response(response, content)
-        split = content.split(",")
-        standard = split[:11]
-        (energy_generated, energy_exported, average_generation, minimum_generation, maximum_generation,
-         average_efficiency, outputs, actual_date_from, actual_date_to, record_efficiency, record_date) = standard
-
-        extra = split[11:]
-
-        (energy_consumed, peak_energy_import, off_peak_energy_import, shoulder_energy_import,
-         high_shoulder_energy_import, average_consumption,
-         minimum_consumption, maximum_consumption) = extra[:8] if consumption_and_import else [None] * 8
-
-        (credit_amount, debit_amount) = extra[-2:] if credits_debits else [None] * 2
-
-        return Statistic(int(energy_generated), int(energy_exported), int(average_generation), int(minimum_generation),
-                         int(maximum_generation), float(average_efficiency), int(outputs),
-                         from_pvoutput_date(actual_date_from), from_pvoutput_date(actual_date_to),
-                         float(record_efficiency), from_pvoutput_date(record_date),
-                         None if energy_consumed is None else int(energy_consumed),
-                         None if peak_energy_import is None else int(peak_energy_import),
-                         None if off_peak_energy_import is None else int(off_peak_energy_import),
-                         None if shoulder_energy_import is None else int(shoulder_energy_import),
-                         None if high_shoulder_energy_import is None else int(high_shoulder_energy_import),
-                         None if average_consumption is None else int(average_consumption),
-                         None if minimum_consumption is None else int(minimum_consumption),
-                         None if maximum_consumption is None else int(maximum_consumption),
-                         None if credit_amount is None else float(credit_amount),
-                         None if debit_amount is None else float(debit_amount))
+
+        cache = self.__cache
+        store = self.__store
+        final = date_from is not None and self._is_final(date_to)
+        ttl = None if cache is None or final else cache.statistic_ttl
+        if store is not None and final:
+            stored = store.get_statistic(system_id or self.__system_id, date_from, date_to,
+                                         consumption_and_import, credits_debits)
+            if stored is not None:
+                return stored
+        if store is not None and date_from is not None and date_to is not None and not credits_debits:
+            local = self._get_local_statistic(store, date_from, date_to, consumption_and_import, system_id,
+                                              max_age)
+            if local is not None:
+                return local
+        result = self._get("service/r2/getstatistic.jsp", params,
+                           lambda content: parse_statistic(content, consumption_and_import, credits_debits), ttl,
+                           max_age=max_age)
+        if store is not None and final:
+            store.put_statistic(system_id or self.__system_id, date_from, date_to,
+                                consumption_and_import, credits_debits, result)
+        return result
+
+    @staticmethod
+    def _output_params(date_from: Optional[datetime.date], date_to: Optional[datetime.date],
+                       limit: Optional[int], system_id: Optional[int]) -> dict:
+        params = {}
+        if date_from:
+            params["df"] = to_pvoutput_date(date_from)
+        if date_to:
+            params["dt"] = to_pvoutput_date(date_to)
+        if limit:
+            params["limit"] = str(limit)
+        if system_id:
+            params["sid1"] = str(system_id)
+        return params
+
+    def get_output(self, date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None,
+                   limit: Optional[int] = None, system_id: Optional[int] = None,
+                   max_age: Optional[float] = None) -> List[Output]:
+        """
+        Gets the daily outputs of the system, most recent first. Days without an output are not included.
+
+        :param max_age: If set, cached results older than this many seconds are not used. 0 always makes a request
+        """
+        params = self._output_params(date_from, date_to, limit, system_id)
+        cache = self.__cache
+        ttl = None if cache is None or self._is_final(date_to) else cache.status_ttl
+        return list(self._get("service/r2/getoutput.jsp", params, parse_outputs, ttl, max_age=max_age))
+
+    def _get_local_statistic(self, store: "PVOutputStore", date_from: datetime.date, date_to: datetime.date,
+                             consumption_and_import: bool, system_id: Optional[int],
+                             max_age: Optional[float] = None) -> Optional[Statistic]:
+        """
+        Computes a statistic from daily outputs. Days that can no longer change come from the store, and are synced
+        first if doing so takes a single request. Recent days are requested with getoutput.jsp. That request always
+        covers the same few days so that every period ending today shares one cached response.
+
+        :return: The statistic, or None if it can't be computed without downloading lots of outputs
+        """
+        store_system_id = system_id or self.__system_id
+        final_to = min(date_to, self._last_final_date())
+        aggregates = []
+        if date_from <= final_to:
+            unsynced = store.get_unsynced_output_dates(store_system_id, date_from, final_to)
+            if unsynced:
+                if (unsynced[-1] - unsynced[0]).days >= OUTPUT_PAGE_SIZE:
+                    return None
+                self._sync_output_page(store, unsynced[0], unsynced[-1], system_id)
+            aggregates.append(store.aggregate_outputs(store_system_id, date_from, final_to))
+        if date_to > final_to:
+            live_from = max(date_from, final_to + datetime.timedelta(days=1))
+            recent_from = self._last_final_date() + datetime.timedelta(days=1)
+            try:
+                # includes tomorrow in case the system's timezone is ahead of ours
+                outputs = self.get_output(recent_from, recent_from + datetime.timedelta(days=2),
+                                          limit=OUTPUT_PAGE_SIZE, system_id=system_id, max_age=max_age)
+            except NoDataPVOutputException:
+                outputs = []
+            aggregates.append(aggregate_outputs(output for output in outputs if live_from <= output.date <= date_to))
+        aggregate = combine_output_aggregates(aggregates)
+        if aggregate.outputs == 0:
+            raise NoOutputsPVOutputException("There are no outputs between {} and {}".format(date_from, date_to))
+        return aggregate.to_statistic(consumption_and_import)
+
+    def _last_final_date(self) -> datetime.date:
+        return datetime.date.today() - datetime.timedelta(days=2)
+
+    def _sync_output_page(self, store: "PVOutputStore", date_from: datetime.date, date_to: datetime.date,
+                          system_id: Optional[int]):
+        # this skips the cache because the outputs go straight into the store
+        params = self._output_params(date_from, date_to, OUTPUT_PAGE_SIZE, system_id)
+        with self._instrument("service/r2/getoutput.jsp", params) as metrics:
+            (response, content) = self._send("GET", "service/r2/getoutput.jsp", params, metrics)
+            try:
+                self._check_response(response, content)
+                start = time.perf_counter()
+                outputs = parse_outputs(content)
+                metrics.parse_time = time.perf_counter() - start
+            except NoDataPVOutputException:
+                outputs = []
+        store.put_outputs(system_id or self.__system_id, outputs, date_from, date_to)
+
+    def sync_outputs(self, store: "PVOutputStore", date_from: datetime.date, date_to: datetime.date,
+                     system_id: Optional[int] = None) -> int:
+        """
+        Downloads the daily outputs between date_from and date_to that the store doesn't have yet.
+        Only days that can no longer change are stored, so recent days are skipped.
+        Requests are made with :data:`PRIORITY_BACKGROUND`.
+
+        :return: The number of requests that were made
+        """
+        date_to = min(date_to, self._last_final_date())
+        requests = 0
+        with request_priority(PRIORITY_BACKGROUND):
+            while date_from <= date_to:
+                unsynced = store.get_unsynced_output_dates(system_id or self.__system_id, date_from, date_to)
+                if not unsynced:
+                    break
+                page_to = min(date_to, unsynced[0] + datetime.timedelta(days=OUTPUT_PAGE_SIZE - 1))
+                self._sync_output_page(store, unsynced[0], page_to, system_id)
+                requests += 1
+                date_from = page_to + datetime.timedelta(days=1)
+        return requests
+
+    def iter_status_history(self, date: Optional[datetime.date] = None, ascending: bool = False,
+                            limit: Optional[int] = None, time_from: Optional[datetime.time] = None,
+                            time_to: Optional[datetime.time] = None, extended_data: bool = False,
+                            system_id: Optional[int] = None) -> Iterator[HistoryStatus]:
+        """
+        Like ``get_status(history=True)``, but rows are parsed lazily as the returned iterator is consumed.
+        This does not use the cache and is meant for bulk history pulls.
+        """
+        params = self._status_params(date=date, history=True, ascending=ascending, limit=limit,
+                                     time_from=time_from, time_to=time_to, extended_data=extended_data,
+                                     system_id=system_id)
+        with self._instrument("service/r2/getstatus.jsp", params) as metrics:
+            # rows are parsed after this returns, so parse_time stays 0
+            (response, content) = self._send("GET", "service/r2/getstatus.jsp", params, metrics)
+            self._check_response(response, content)
+        return iter_history(content)
+
+    def _get_day_history(self, date: datetime.date, system_id: Optional[int], extended_data: bool,
+                         after: Optional[datetime.time] = None) -> List[HistoryStatus]:
+        """
+        Gets every status for a day in ascending order, requesting more pages if a day has more rows than
+        a single request can return.
+
+        :param after: If set, only statuses after this time are returned
+        """
+        r = []
+        while True:
+            try:
+                page = list(self.iter_status_history(date=date, ascending=True, limit=HISTORY_PAGE_SIZE,
+                                                     time_from=after, extended_data=extended_data,
+                                                     system_id=system_id))
+            except NoStatusPVOutputException:
+                return r
+            full_page = len(page) >= HISTORY_PAGE_SIZE
+            if after is not None:
+                # time_from is inclusive
+                page = [status for status in page if status.time > after]
+            r.extend(page)
+            if not full_page or not page:
+                return r
+            after = page[-1].time
+
+    def _get_background_day_history(self, date: datetime.date, system_id: Optional[int], extended_data: bool,
+                                     rate_limiter: Optional[RateLimiter] = None) -> List[HistoryStatus]:
+        previous = getattr(_request_context, "rate_limiter", None)
+        _request_context.rate_limiter = rate_limiter
+        try:
+            with request_priority(PRIORITY_BACKGROUND):
+                return self._get_day_history(date, system_id, extended_data)
+        finally:
+            _request_context.rate_limiter = previous
+
+    def sync_history(self, store: "PVOutputStore", date_from: datetime.date, date_to: datetime.date,
+                     system_id: Optional[int] = None, extended_data: bool = False) -> int:
+        """
+        Brings the history stored in the store up to date. For each day, only statuses newer than the last stored
+        status are requested, and days that are complete and can no longer change are skipped entirely.
+        Requests are made with :data:`PRIORITY_BACKGROUND`.
+
+        :return: The number of new statuses that were stored
+        """
+        store_system_id = system_id or self.__system_id
+        count = 0
+        date = date_from
+        with request_priority(PRIORITY_BACKGROUND):
+            while date <= date_to:
+                if not store.is_history_complete(store_system_id, date):
+                    statuses = self._get_day_history(date, system_id, extended_data,
+                                                     after=store.get_last_history_time(store_system_id, date))
+                    store.put_history(store_system_id, statuses)
+                    count += len(statuses)
+                    if self._is_final(date):
+                        store.set_history_complete(store_system_id, date)
+                date += datetime.timedelta(days=1)
+        return count
+
+    def backfill_history(self, date_from: datetime.date, date_to: datetime.date,
+                         system_ids: Optional[Iterable[Optional[int]]] = None, extended_data: bool = False,
+                         max_workers: int = 4, rate_limiter: Optional[RateLimiter] = None) -> Iterator[_DayHistory]:
+        """
+        Gets the history of every day between date_from and date_to (inclusive) using a pool of workers.
+        Results are yielded in date order as soon as they are ready, even though later days may be fetched first.
+        Requests are made with :data:`PRIORITY_BACKGROUND`, so a rate limiter spaces them out,
+        and failed requests are retried according to this client's retry policy.
+
+        :param system_ids: The system ids to get history for using the sid1 parameter. None gets the history of this
+                           client's system.
+        :param max_workers: The maximum number of requests that are in flight at once
+        :param rate_limiter: Used for the backfill's requests if this client has no rate limiter. Defaults to a
+                             :class:`RateLimiter` that waits up to an hour for the quota to reset, so a long backfill
+                             pauses instead of being refused by pvoutput.org
+        :return: An iterator of (system_id, date, statuses). Days without any statuses have an empty list.
+        """
+        system_ids = list(system_ids) if system_ids is not None else [None]
+        if self.__rate_limiter is not None:
+            rate_limiter = None
+        elif rate_limiter is None:
+            rate_limiter = RateLimiter(max_background_wait=3600.0)
+
+        def tasks():
+            date = date_from
+            while date <= date_to:
+                for system_id in system_ids:
+                    yield system_id, date
+                date += datetime.timedelta(days=1)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for system_id, date in tasks():
+                pending.append((system_id, date, executor.submit(self._get_background_day_history,
+                                                                 date, system_id, extended_data, rate_limiter)))
+                # only keep a bounded number of days queued so results stream back instead of piling up
+                if len(pending) >= max_workers * 2:
+                    (system_id, date, future) = pending.popleft()
+                    yield system_id, date, future.result()
+            while pending:
+                (system_id, date, future) = pending.popleft()
+                yield system_id, date, future.result()
+
+    def subscribe(self, callback: Optional[Callable[["StatusDelta"], None]] = None, interval: float = 300.0,
+                  extended_data: bool = False, system_id: Optional[int] = None,
+                  today: Optional[Callable[[], datetime.date]] = None,
+                  error_callback: Optional[Callable[[Exception], None]] = None,
+                  start: bool = True) -> "StatusSubscription":
+        """
+        Subscribes to new statuses of a system. See :class:`StatusSubscription`
+
+        :param callback: Called with a :class:`StatusDelta` whenever new statuses are found
+        :param interval: The number of seconds between polls until the system's status interval is known
+        :param today: Returns the system's current date. Defaults to :meth:`datetime.date.today`
+        :param error_callback: Called with exceptions raised while polling in the background
+        :param start: True to start polling on a background thread, False to only poll when
+                      :meth:`StatusSubscription.poll` is called
+        """
+        subscription = StatusSubscription(self, interval=interval, extended_data=extended_data, system_id=system_id,
+                                          today=today, error_callback=error_callback)
+        if callback is not None:
+            subscription.add_callback(callback)
+        if start:
+            subscription.start()
+        return subscription
+
+
+class StatusDelta(namedtuple("StatusDelta", "date statuses previous")):
+    """
+    The statuses a :class:`StatusSubscription` found in one poll. statuses are new statuses in ascending order and
+    previous is the latest status before them, or None if they are the first statuses of the day the subscription has.
+    """
+    __slots__ = ()
+
+    @property
+    def latest(self) -> HistoryStatus:
+        return self.statuses[-1]
+
+
+class StatusSubscription:
+    """
+    Polls a system for new statuses and passes them to callbacks as a :class:`StatusDelta`. The first poll of a day
+    gets every status of that day and later polls only request statuses after the latest one using time_from,
+    so the whole day is not downloaded again. The poll interval adapts to the system's status interval.
+
+    When the day changes, the previous day is polled once more so statuses uploaded just before midnight are not
+    missed. If the client has a store, new statuses are also put in the store.
+    """
+    MIN_INTERVAL = 60.0
+
+    def __init__(self, pvoutput: PVOutput, interval: float = 300.0, extended_data: bool = False,
+                 system_id: Optional[int] = None, today: Optional[Callable[[], datetime.date]] = None,
+                 error_callback: Optional[Callable[[Exception], None]] = None):
+        self.__pvoutput = pvoutput
+        self.interval = interval
+        """The number of seconds between polls on the background thread"""
+        self.__extended_data = extended_data
+        self.__system_id = system_id
+        self.__today = today or datetime.date.today
+        self.__error_callback = error_callback
+        self.__callbacks: List[Callable[[StatusDelta], None]] = []
+        self.__date: Optional[datetime.date] = None
+        self.__latest: Optional[HistoryStatus] = None
+        self.__lock = threading.Lock()
+        self.__stopped: Optional[threading.Event] = None
+        """Set to stop the current background thread"""
+
+    @property
+    def latest(self) -> Optional[HistoryStatus]:
+        """The latest status of the current day, or None if there isn't one yet"""
+        return self.__latest
+
+    def add_callback(self, callback: Callable[[StatusDelta], None]):
+        self.__callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[StatusDelta], None]):
+        self.__callbacks.remove(callback)
+
+    def poll(self) -> List[StatusDelta]:
+        """
+        Requests statuses newer than the latest one and passes them to the callbacks on the calling thread
+
+        :return: The deltas that were passed to the callbacks. This is empty when there are no new statuses
+        """
+        with self.__lock:
+            today = self.__today()
+            deltas = []
+            if self.__date is not None and self.__date != today:
+                deltas.append(self._poll_date(self.__date))
+                self.__latest = None
+            self.__date = today
+            deltas.append(self._poll_date(today))
+        deltas = [delta for delta in deltas if delta is not None]
+        for delta in deltas:
+            for callback in list(self.__callbacks):
+                callback(delta)
+        return deltas
+
+    def _poll_date(self, date: datetime.date) -> Optional[StatusDelta]:
+        # must be called while holding the lock
+        previous = self.__latest
+        statuses = self.__pvoutput._get_day_history(date, self.__system_id, self.__extended_data,
+                                                   after=None if previous is None else previous.time)
+        if not statuses:
+            return None
+        store = self.__pvoutput.store
+        if store is not None:
+            store.put_history(self.__system_id or self.__pvoutput.system_id, statuses)
+        times = [status.time for status in ([previous] if previous is not None else []) + statuses]
+        gaps = [(datetime.datetime.combine(date, b) - datetime.datetime.combine(date, a)).total_seconds()
+                for a, b in zip(times, times[1:])]
+        if gaps:
+            self.interval = max(self.MIN_INTERVAL, min(gaps))
+        self.__latest = statuses[-1]
+        return StatusDelta(date, tuple(statuses), previous)
+
+    def start(self):
+        """Starts polling on a background thread with :data:`PRIORITY_BACKGROUND`"""
+        if self.__stopped is not None:
+            return
+        stopped = self.__stopped = threading.Event()
+        threading.Thread(target=self._run, args=(stopped,), name="PVOutputStatusSubscription", daemon=True).start()
+
+    def stop(self):
+        """Stops the background thread. A poll that is in progress still finishes"""
+        if self.__stopped is not None:
+            self.__stopped.set()
+            self.__stopped = None
+
+    def _run(self, stopped: threading.Event):
+        with request_priority(PRIORITY_BACKGROUND):
+            while not stopped.is_set():
+                try:
+                    self.poll()
+                except Exception as e:
+                    if self.__error_callback is not None:
+                        self.__error_callback(e)
+                stopped.wait(self.interval)
+
+
+class PVOutputStore:
+    """
+    Keeps history, day statistics and statistics on disk in a SQLite database so that data for past days,
+    which never changes, only has to be downloaded once. This is thread safe.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        """
+        :param path: The path to the SQLite database file. It is created if it does not exist.
+        """
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        with self.__lock, self.__connection:
+            self.__connection.executescript("""
+                CREATE TABLE IF NOT EXISTS history (
+                    system_id INTEGER NOT NULL, date TEXT NOT NULL, time TEXT NOT NULL,
+                    energy_generation INTEGER, energy_efficiency REAL, instantaneous_power INTEGER,
+                    average_power INTEGER, normalised_output REAL, energy_consumption INTEGER,
+                    power_consumption INTEGER, temperature REAL, voltage REAL, extended_values TEXT,
+                    PRIMARY KEY (system_id, date, time)
+                );
+                CREATE TABLE IF NOT EXISTS history_complete (
+                    system_id INTEGER NOT NULL, date TEXT NOT NULL, PRIMARY KEY (system_id, date)
+                );
+                CREATE TABLE IF NOT EXISTS day_statistics (
+                    system_id INTEGER NOT NULL, date TEXT NOT NULL,
+                    energy_generation INTEGER, power_generation INTEGER, peak_power INTEGER, peak_power_time TEXT,
+                    energy_consumption INTEGER, power_consumption INTEGER, standby_power INTEGER,
+                    standby_power_time TEXT, temperature_min REAL, temperature_max REAL, temperature_average REAL,
+                    PRIMARY KEY (system_id, date)
+                );
+                CREATE TABLE IF NOT EXISTS output (
+                    system_id INTEGER NOT NULL, date TEXT NOT NULL,
+                    energy_generated INTEGER, efficiency REAL, energy_exported INTEGER, energy_used INTEGER,
+                    peak_power INTEGER, peak_time TEXT, condition TEXT, temperature_min REAL, temperature_max REAL,
+                    peak_energy_import INTEGER, off_peak_energy_import INTEGER, shoulder_energy_import INTEGER,
+                    high_shoulder_energy_import INTEGER,
+                    PRIMARY KEY (system_id, date)
+                );
+                CREATE TABLE IF NOT EXISTS output_synced (
+                    system_id INTEGER NOT NULL, date TEXT NOT NULL, PRIMARY KEY (system_id, date)
+                );
+                -- period is YYYYMM for a month or YYYY for a year
+                CREATE TABLE IF NOT EXISTS output_rollup (
+                    system_id INTEGER NOT NULL, period TEXT NOT NULL,
+                    outputs INTEGER, energy_generated INTEGER, minimum_generation INTEGER, maximum_generation INTEGER,
+                    energy_exported INTEGER, efficiency_sum REAL, record_efficiency REAL, record_date TEXT,
+                    date_from TEXT, date_to TEXT, consumption_outputs INTEGER, energy_consumed INTEGER,
+                    minimum_consumption INTEGER, maximum_consumption INTEGER, peak_energy_import INTEGER,
+                    off_peak_energy_import INTEGER, shoulder_energy_import INTEGER, high_shoulder_energy_import INTEGER,
+                    PRIMARY KEY (system_id, period)
+                );
+                CREATE TABLE IF NOT EXISTS statistic (
+                    system_id INTEGER NOT NULL, date_from TEXT NOT NULL, date_to TEXT NOT NULL,
+                    consumption_and_import INTEGER NOT NULL, credits_debits INTEGER NOT NULL, value TEXT NOT NULL,
+                    PRIMARY KEY (system_id, date_from, date_to, consumption_and_import, credits_debits)
+                );
+            """)
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def _execute(self, sql: str, parameters=()) -> list:
+        with self.__lock, self.__connection:
+            return self.__connection.execute(sql, parameters).fetchall()
+
+    def put_history(self, system_id: int, statuses: Iterable[HistoryStatus]):
+        rows = [(system_id, to_pvoutput_date(status.date), to_pvoutput_time(status.time), status.energy_generation,
+                 status.energy_efficiency, status.instantaneous_power, status.average_power, status.normalised_output,
+                 status.energy_consumption, status.power_consumption, status.temperature, status.voltage,
+                 None if status.extended_values is None else _format_extended_values(status.extended_values))
+                for status in statuses]
+        with self.__lock, self.__connection:
+            self.__connection.executemany("INSERT OR REPLACE INTO history VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+
+    def get_history(self, system_id: int, date: datetime.date) -> List[HistoryStatus]:
+        """:return: The stored statuses for the date in ascending order"""
+        rows = self._execute("SELECT * FROM history WHERE system_id = ? AND date = ? ORDER BY time",
+                             (system_id, to_pvoutput_date(date)))
+        return [HistoryStatus(from_pvoutput_date(row[1]), from_pvoutput_time(row[2]), *row[3:12],
+                              None if row[12] is None else _parse_extended_values(row[12].split(",")))
+                for row in rows]
+
+    def get_last_history_time(self, system_id: int, date: datetime.date) -> Optional[datetime.time]:
+        rows = self._execute("SELECT MAX(time) FROM history WHERE system_id = ? AND date = ?",
+                             (system_id, to_pvoutput_date(date)))
+        return None if rows[0][0] is None else from_pvoutput_time(rows[0][0])
+
+    def is_history_complete(self, system_id: int, date: datetime.date) -> bool:
+        return bool(self._execute("SELECT 1 FROM history_complete WHERE system_id = ? AND date = ?",
+                                  (system_id, to_pvoutput_date(date))))
+
+    def set_history_complete(self, system_id: int, date: datetime.date):
+        self._execute("INSERT OR REPLACE INTO history_complete VALUES (?,?)", (system_id, to_pvoutput_date(date)))
+
+    def put_day_statistics(self, system_id: int, date: datetime.date, statistics: DayStatistics):
+        standard = statistics.standard
+        owner = statistics.owner or DayStatisticsOwner(None, None, None, None)
+        temperature = statistics.temperature or DayStatisticsTemperature(None, None, None)
+        self._execute("INSERT OR REPLACE INTO day_statistics VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", (
+            system_id, to_pvoutput_date(date), standard.energy_generation, standard.power_generation,
+            standard.peak_power, to_pvoutput_time(standard.peak_power_time), owner.energy_consumption,
+            owner.power_consumption, owner.standby_power,
+            None if owner.standby_power_time is None else to_pvoutput_time(owner.standby_power_time),
+            temperature.temperature_min, temperature.temperature_max, temperature.temperature_average
+        ))
+
+    def get_day_statistics(self, system_id: int, date: datetime.date) -> Optional[DayStatistics]:
+        rows = self._execute("SELECT * FROM day_statistics WHERE system_id = ? AND date = ?",
+                             (system_id, to_pvoutput_date(date)))
+        if not rows:
+            return None
+        row = rows[0]
+        standard = DayStatisticsStandard(row[2], row[3], row[4], from_pvoutput_time(row[5]))
+        owner = None
+        if row[6] is not None:
+            owner = DayStatisticsOwner(row[6], row[7], row[8], from_pvoutput_time(row[9]))
+        temperature = None
+        if row[10] is not None:
+            temperature = DayStatisticsTemperature(row[10], row[11], row[12])
+        return DayStatistics(standard, owner, temperature)
+
+    def put_outputs(self, system_id: int, outputs: Iterable[Output], date_from: datetime.date,
+                    date_to: datetime.date):
+        """
+        Stores the outputs of every day between date_from and date_to and marks those days as synced.
+        Days in that range without an output are still marked as synced because there is nothing more to get.
+        """
+        rows = [(system_id, to_pvoutput_date(output.date), output.energy_generated, output.efficiency,
+                 output.energy_exported, output.energy_used, output.peak_power,
+                 None if output.peak_time is None else to_pvoutput_time(output.peak_time), output.condition,
+                 output.temperature_min, output.temperature_max, output.peak_energy_import,
+                 output.off_peak_energy_import, output.shoulder_energy_import, output.high_shoulder_energy_import)
+                for output in outputs]
+        dates = []
+        periods = set()
+        date = date_from
+        while date <= date_to:
+            dates.append((system_id, to_pvoutput_date(date)))
+            periods.add(date.strftime("%Y%m"))
+            periods.add(date.strftime("%Y"))
+            date += datetime.timedelta(days=1)
+        with self.__lock, self.__connection:
+            connection = self.__connection
+            connection.executemany("INSERT OR REPLACE INTO output VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+            connection.executemany("INSERT OR REPLACE INTO output_synced VALUES (?,?)", dates)
+            for period in periods:
+                where = "system_id = ? AND substr(date, 1, {}) = ?".format(len(period))
+                row = self._aggregate_row(where, (system_id, period))
+                connection.execute("INSERT OR REPLACE INTO output_rollup VALUES "
+                                   "(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", (system_id, period) + row)
+
+    def _aggregate_row(self, where: str, parameters: tuple) -> tuple:
+        # must be called while holding the lock
+        connection = self.__connection
+        row = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(energy_generated), 0), MIN(energy_generated), MAX(energy_generated), "
+            "COALESCE(SUM(energy_exported), 0), COALESCE(SUM(efficiency), 0.0), MAX(COALESCE(efficiency, 0.0)), NULL, "
+            "MIN(date), MAX(date), COUNT(energy_used), COALESCE(SUM(energy_used), 0), MIN(energy_used), "
+            "MAX(energy_used), COALESCE(SUM(peak_energy_import), 0), COALESCE(SUM(off_peak_energy_import), 0), "
+            "COALESCE(SUM(shoulder_energy_import), 0), COALESCE(SUM(high_shoulder_energy_import), 0) "
+            "FROM output WHERE " + where, parameters).fetchone()
+        record = connection.execute("SELECT date FROM output WHERE " + where +
+                                    " ORDER BY COALESCE(efficiency, 0.0) DESC, date LIMIT 1", parameters).fetchone()
+        return row[:7] + (None if record is None else record[0],) + row[8:]
+
+    @staticmethod
+    def _to_aggregate(row: tuple) -> OutputAggregate:
+        return OutputAggregate(*row[:7], None if row[7] is None else from_pvoutput_date(row[7]),
+                               None if row[8] is None else from_pvoutput_date(row[8]),
+                               None if row[9] is None else from_pvoutput_date(row[9]), *row[10:])
+
+    def get_unsynced_output_dates(self, system_id: int, date_from: datetime.date,
+                                  date_to: datetime.date) -> List[datetime.date]:
+        synced = {row[0] for row in self._execute(
+            "SELECT date FROM output_synced WHERE system_id = ? AND date BETWEEN ? AND ?",
+            (system_id, to_pvoutput_date(date_from), to_pvoutput_date(date_to)))}
+        r = []
+        date = date_from
+        while date <= date_to:
+            if to_pvoutput_date(date) not in synced:
+                r.append(date)
+            date += datetime.timedelta(days=1)
+        return r
+
+    def get_outputs(self, system_id: int, date_from: datetime.date, date_to: datetime.date) -> List[Output]:
+        """:return: The stored outputs between the two dates in ascending order"""
+        rows = self._execute("SELECT * FROM output WHERE system_id = ? AND date BETWEEN ? AND ? ORDER BY date",
+                             (system_id, to_pvoutput_date(date_from), to_pvoutput_date(date_to)))
+        return [Output(from_pvoutput_date(row[1]), *row[2:7], None if row[7] is None else from_pvoutput_time(row[7]),
+                       *row[8:])
+                for row in rows]
+
+    def aggregate_outputs(self, system_id: int, date_from: datetime.date, date_to: datetime.date) -> OutputAggregate:
+        """
+        Totals the stored outputs between two dates. Whole years and whole months use the precomputed rollups,
+        so only the days at the start and end of the period that don't fill a month are read individually.
+        """
+        aggregates = []
+        with self.__lock:
+            date = date_from
+            while date <= date_to:
+                year_end = datetime.date(date.year, 12, 31)
+                month_end = datetime.date(date.year, date.month, calendar.monthrange(date.year, date.month)[1])
+                if date.month == 1 and date.day == 1 and year_end <= date_to:
+                    period, end = date.strftime("%Y"), year_end
+                elif date.day == 1 and month_end <= date_to:
+                    period, end = date.strftime("%Y%m"), month_end
+                else:
+                    period, end = None, min(month_end, date_to)
+                if period is None:
+                    row = self._aggregate_row("system_id = ? AND date BETWEEN ? AND ?",
+                                              (system_id, to_pvoutput_date(date), to_pvoutput_date(end)))
+                else:
+                    row = self.__connection.execute("SELECT * FROM output_rollup WHERE system_id = ? AND period = ?",
+                                                    (system_id, period)).fetchone()
+                    row = None if row is None else row[2:]
+                if row is not None:
+                    aggregates.append(self._to_aggregate(row))
+                date = end + datetime.timedelta(days=1)
+        return combine_output_aggregates(aggregates)
+
+    def put_statistic(self, system_id: int, date_from: datetime.date, date_to: datetime.date,
+                      consumption_and_import: bool, credits_debits: bool, statistic: Statistic):
+        value = ",".join("" if field is None else
+                         to_pvoutput_date(field) if isinstance(field, datetime.date) else str(field)
+                         for field in statistic)
+        self._execute("INSERT OR REPLACE INTO statistic VALUES (?,?,?,?,?,?)", (
+            system_id, to_pvoutput_date(date_from), to_pvoutput_date(date_to),
+            int(consumption_and_import), int(credits_debits), value
+        ))
+
+    def get_statistic(self, system_id: int, date_from: datetime.date, date_to: datetime.date,
+                      consumption_and_import: bool, credits_debits: bool) -> Optional[Statistic]:
+        rows = self._execute("SELECT value FROM statistic WHERE system_id = ? AND date_from = ? AND date_to = ? "
+                             "AND consumption_and_import = ? AND credits_debits = ?",
+                             (system_id, to_pvoutput_date(date_from), to_pvoutput_date(date_to),
+                              int(consumption_and_import), int(credits_debits)))
+        if not rows:
+            return None
+        split = rows[0][0].split(",")
+        # stored in the same order as getstatistic.jsp returns, with the optional sections in place
+        content = ",".join(split[:11] + [value for value in split[11:] if value])
+        return parse_statistic(content, consumption_and_import, credits_debits)
+
+
+FleetResults = namedtuple("FleetResults", "results errors")
+
+
+class PVOutputFleet:
+    """
+    Queries many systems at once. Requests for different systems are made concurrently and share one transport,
+    cache, store and rate limiter.
+
+    Systems with their own API key get their own :class:`PVOutput`. Systems without one are requested through the
+    client of the default API key using the sid1 parameter, which requires that key to have access to them.
+
+    An existing client can be used as the default client, in which case the other clients share its transport,
+    cache, store, rate limiter, retry policy, circuit breaker and hooks unless they are given.
+    """
+
+    def __init__(self, systems: Iterable[Union[int, Tuple[int, Optional[str]]]], api_key: Optional[str] = None,
+                 default_system_id: Optional[int] = None, host: Optional[str] = None,
+                 transport: Optional[Transport] = None, timeout: Optional[float] = None,
+                 cache: Optional[ResponseCache] = None, store: Optional["PVOutputStore"] = None,
+                 rate_limiter: Optional[RateLimiter] = None, max_workers: int = 4,
+                 hooks: Optional[Iterable[Callable[[RequestMetrics], None]]] = None,
+                 retry_policy: Optional[RetryPolicy] = None, circuit_breaker: Optional[CircuitBreaker] = None,
+                 default_client: Optional[PVOutput] = None):
+        """
+        :param systems: System ids, or tuples of a system id and the API key for that system
+        :param api_key: The API key used for systems that don't have their own. Required without default_client
+        :param default_system_id: The system that api_key belongs to. Required without default_client
+        :param hooks: The instrumentation hooks of every client. See :class:`PVOutput`
+        :param default_client: The client used for systems without their own API key. It is not closed by the fleet
+        """
+        if default_client is not None:
+            host = default_client.host if host is None else host
+            transport = default_client.transport if transport is None else transport
+            cache = default_client.cache if cache is None else cache
+            store = default_client.store if store is None else store
+            rate_limiter = default_client.rate_limiter if rate_limiter is None else rate_limiter
+            retry_policy = default_client.retry_policy if retry_policy is None else retry_policy
+            circuit_breaker = default_client.circuit_breaker if circuit_breaker is None else circuit_breaker
+            hooks = default_client.hooks if hooks is None else hooks
+        elif api_key is None or default_system_id is None:
+            raise ValueError("api_key and default_system_id are required without a default_client")
+        hooks = list(hooks or ())
+        host = host or "https://pvoutput.org"
+        self.__owns_transport = transport is None
+        self.__transport = transport or Httplib2Transport(timeout=timeout, max_connections=max_workers)
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        def create_client(system_id: int, key: str) -> PVOutput:
+            return PVOutput(system_id=system_id, api_key=key, host=host, transport=self.__transport, cache=cache,
+                            store=store, rate_limiter=rate_limiter, retry_policy=retry_policy,
+                            circuit_breaker=circuit_breaker, hooks=hooks)
+        default_client = default_client or create_client(default_system_id, api_key)
+        self.__clients: Dict[int, Tuple[PVOutput, Optional[int]]] = OrderedDict()
+        """A map of system id to the client to use for it and the sid1 value, if any"""
+        for system in systems:
+            (system_id, key) = (system, None) if isinstance(system, int) else system
+            system_id = int(system_id)
+            if key:
+                self.__clients[system_id] = (create_client(system_id, key), None)
+            elif system_id == default_client.system_id:
+                self.__clients[system_id] = (default_client, None)
+            else:
+                self.__clients[system_id] = (default_client, system_id)
+
+    @property
+    def system_ids(self) -> List[int]:
+        return list(self.__clients)
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+        if self.__owns_transport:
+            self.__transport.close()
+
+    def _run(self, method_name: str, **kwargs) -> FleetResults:
+        futures = OrderedDict()
+        for system_id, (client, sid1) in self.__clients.items():
+            futures[system_id] = self.__executor.submit(_bind_priority(getattr(client, method_name)),
+                                                        system_id=sid1, **kwargs)
+        results = OrderedDict()
+        errors = OrderedDict()
+        for system_id, future in futures.items():
+            try:
+                results[system_id] = future.result()
+            except PVOutputException as e:
+                errors[system_id] = e
+        return FleetResults(results, errors)
+
+    def get_status(self, **kwargs) -> FleetResults:
+        """
+        Calls :meth:`PVOutput.get_status` for every system with the given keyword arguments (except system_id)
+
+        :return: The results keyed by system id, and the :class:`PVOutputException` of any system that failed
+        """
+        return self._run("get_status", **kwargs)
+
+    def get_statistic(self, **kwargs) -> FleetResults:
+        """
+        Calls :meth:`PVOutput.get_statistic` for every system with the given keyword arguments (except system_id)
+
+        :return: The results keyed by system id, and the :class:`PVOutputException` of any system that failed
+        """
+        return self._run("get_statistic", **kwargs)
+
+
+class AsyncPVOutput:
+    """
+    Exposes the requests of a :class:`PVOutput` as coroutines. httplib2 is blocking, so requests run on a thread pool,
+    which means the transport, cache and parsing are all shared with the wrapped client.
+    """
+
+    def __init__(self, pvoutput: PVOutput, executor: Optional[Executor] = None, max_workers: int = 4):
+        self.__pvoutput = pvoutput
+        self.__owns_executor = executor is None
+        self.__executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+
+    @property
+    def pvoutput(self) -> PVOutput:
+        return self.__pvoutput
+
+    async def _run(self, function, *args, **kwargs):
+        import asyncio  # only imported by async users, because it is slow to import
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.__executor, functools.partial(_bind_priority(function), *args, **kwargs))
+
+    async def get_status(self, *args, **kwargs) -> Union[GetStatus, DayStatistics, List[HistoryStatus]]:
+        """Accepts the same arguments as :meth:`PVOutput.get_status`"""
+        return await self._run(self.__pvoutput.get_status, *args, **kwargs)
+
+    async def get_statistic(self, *args, **kwargs) -> Statistic:
+        """Accepts the same arguments as :meth:`PVOutput.get_statistic`"""
+        return await self._run(self.__pvoutput.get_statistic, *args, **kwargs)
+
+    def close(self):
+        if self.__owns_executor:
+            self.__executor.shutdown(wait=False)
+
+
+def gather(*awaitables) -> list:
+    """
+    Runs the given awaitables concurrently on a new event loop and waits for all of them, so that the total time is
+    that of the slowest one. This is meant to be called from synchronous code such as a skill's intent handler.
+
+    Example: ``status, statistics = gather(client.get_status(), client.get_status(day_statistics=True))``
+
+    :return: A list of results in the same order as the awaitables
+    """
+    import asyncio
+
+    async def gather_all():
+        return await asyncio.gather(*awaitables)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather_all())
+    finally:
+        loop.close()
+
+
+def _parse_extended_values(values: List[str]) -> Tuple[Optional[float], ...]:
+    return tuple([None if value in ("NaN", "") else float(value) for value in values])
+
+
+def _format_extended_values(values: Iterable[Optional[float]]) -> str:
+    return ",".join("NaN" if value is None else repr(value) for value in values)
+
+
+def parse_day_statistics(content: str) -> DayStatistics:
+    split_content = [a.split(",") for a in content.split(";")]
+    standard_content = split_content[0]
+    owner_content = None
+    temperature_content = None
+    if len(split_content) == 2:
+        if len(split_content[1]) == 4:
+            owner_content = split_content[1]
+        else:
+            temperature_content = split_content[1]
+    elif len(split_content) >= 3:
+        owner_content = split_content[1]
+        temperature_content = split_content[2]
+
+    (energy_generation, power_generation, peak_power, peak_power_time) = standard_content
+    standard = DayStatisticsStandard(int(energy_generation), int(power_generation), int(peak_power),
+                                     from_pvoutput_time(peak_power_time))
+    owner = None
+    temperature = None
+    if owner_content:
+        (energy_consumption, power_consumption, standby_power, standby_power_time) = owner_content
+        owner = DayStatisticsOwner(int(energy_consumption), int(power_consumption), int(standby_power),
+                                   from_pvoutput_time(standby_power_time))
+    if temperature_content:
+        (temperature_min, temperature_max, temperature_average) = temperature_content
+        temperature = DayStatisticsTemperature(float(temperature_min), float(temperature_max),
+                                               float(temperature_average))
+
+    return DayStatistics(standard, owner, temperature)
+
+
+def iter_history(content: str) -> Iterator[HistoryStatus]:
+    """
+    Lazily parses the rows of a ``get_status(history=True)`` response without splitting the whole body up front.
+    """
+    start = 0
+    length = len(content)
+    while start < length:
+        end = content.find(";", start)
+        if end == -1:
+            end = length
+        data = content[start:end].split(",")
+        start = end + 1
+        extended_values = None
+        if len(data) > 11:
+            extended_values = _parse_extended_values(data[11:])
+        (date, time, energy_generation, energy_efficiency, instantaneous_power, average_power,
+         normalised_output, energy_consumption, power_consumption, temperature, voltage) = data[:11]
+        yield HistoryStatus(from_pvoutput_date(date), from_pvoutput_time(time), int(energy_generation),
+                            float(energy_efficiency), int(instantaneous_power), int(average_power),
+                            float(normalised_output),
+                            None if energy_consumption == "NaN" else int(energy_consumption),
+                            None if power_consumption == "NaN" else int(power_consumption),
+                            None if temperature == "NaN" else float(temperature),
+                            None if voltage == "NaN" else float(voltage), extended_values)
+
+
+def parse_history(content: str) -> List[HistoryStatus]:
+    return list(iter_history(content))
+
+
+_HISTORY_CHUNK_ROWS = 64
+"""Rows parse_history_columns converts at a time, so only a small slice of the split rows is held at once."""
+
+
+def parse_history_columns(content: str) -> HistoryColumns:
+    r = HistoryColumns()
+    columns = [getattr(r, name) for name in HistoryColumns.COLUMNS[1:]]
+    extended_values = r.extended_values
+    nan = math.nan
+    day_seconds = {}
+    time_seconds = {}
+    lines = content.split(";") if content else []
+    for start in range(0, len(lines), _HISTORY_CHUNK_ROWS):
+        # converting a whole column slice at once is much cheaper than appending value by value
+        (dates, times, *values) = itertools.zip_longest(
+            *[line.split(",") for line in lines[start:start + _HISTORY_CHUNK_ROWS]], fillvalue="")
+        for date in set(dates).difference(day_seconds):
+            parsed = from_pvoutput_date(date)
+            day_seconds[date] = calendar.timegm((parsed.year, parsed.month, parsed.day, 0, 0, 0))
+        for time in set(times).difference(time_seconds):
+            parsed = from_pvoutput_time(time)
+            time_seconds[time] = parsed.hour * 3600 + parsed.minute * 60
+        r.timestamps.extend([day_seconds[date] + time_seconds[time] for date, time in zip(dates, times)])
+        for column, column_values in zip(columns, values):
+            column.extend(map(float, column_values))  # float() turns "NaN" into nan
+        extended = values[len(columns):]
+        while len(extended_values) < len(extended):
+            # a column that first appears part way through is missing for the rows before it
+            extended_values.append(array.array("d", [nan]) * start)
+        for column, column_values in itertools.zip_longest(extended_values, extended, fillvalue=("",) * len(dates)):
+            if "" in column_values:
+                column.extend([float(value) if value else nan for value in column_values])
+            else:
+                column.extend(map(float, column_values))
+    return r
+
+
+def parse_status(content: str) -> GetStatus:
+    split = content.split(",")
+    standard_data = split[:9]
+    extended_values = None
+    if len(split) > 9:
+        extended_values = _parse_extended_values(split[9:])
+    (date, time, energy_generation, power_generation, energy_consumption, power_consumption, normalised_output,
+     temperature, voltage) = standard_data
+    return GetStatus(from_pvoutput_date(date), from_pvoutput_time(time), int(energy_generation),
+                     int(power_generation), int(energy_consumption),
+                     int(power_consumption), float(normalised_output),
+                     None if temperature == "NaN" else float(temperature),
+                     None if voltage == "NaN" else float(voltage), extended_values)
+
+
+def parse_statistic(content: str, consumption_and_import: bool, credits_debits: bool) -> Statistic:
+    split = content.split(",")
+    standard = split[:11]
+    (energy_generated, energy_exported, average_generation, minimum_generation, maximum_generation,
+     average_efficiency, outputs, actual_date_from, actual_date_to, record_efficiency, record_date) = standard
+
+    extra = split[11:]
+
+    (energy_consumed, peak_energy_import, off_peak_energy_import, shoulder_energy_import,
+     high_shoulder_energy_import, average_consumption,
+     minimum_consumption, maximum_consumption) = extra[:8] if consumption_and_import else [None] * 8
+
+    (credit_amount, debit_amount) = extra[-2:] if credits_debits else [None] * 2
+
+    return Statistic(int(energy_generated), int(energy_exported), int(average_generation), int(minimum_generation),
+                     int(maximum_generation), float(average_efficiency), int(outputs),
+                     from_pvoutput_date(actual_date_from), from_pvoutput_date(actual_date_to),
+                     float(record_efficiency), from_pvoutput_date(record_date),
+                     None if energy_consumed is None else int(energy_consumed),
+                     None if peak_energy_import is None else int(peak_energy_import),
+                     None if off_peak_energy_import is None else int(off_peak_energy_import),
+                     None if shoulder_energy_import is None else int(shoulder_energy_import),
+                     None if high_shoulder_energy_import is None else int(high_shoulder_energy_import),
+                     None if average_consumption is None else int(average_consumption),
+                     None if minimum_consumption is None else int(minimum_consumption),
+                     None if maximum_consumption is None else int(maximum_consumption),
+                     None if credit_amount is None else float(credit_amount),
+                     None if debit_amount is None else float(debit_amount))
+
+
+def _optional_int(value: str) -> Optional[int]:
+    return None if value in ("NaN", "") else int(value)
+
+
+def _optional_float(value: str) -> Optional[float]:
+    return None if value in ("NaN", "") else float(value)
+
+
+def parse_outputs(content: str) -> List[Output]:
+    r = []
+    for row in content.split(";") if content else ():
+        data = row.split(",")
+        (date, energy_generated, efficiency, energy_exported, energy_used, peak_power, peak_time, condition,
+         temperature_min, temperature_max, peak_energy_import, off_peak_energy_import, shoulder_energy_import,
+         high_shoulder_energy_import) = data[:14]
+        r.append(Output(from_pvoutput_date(date), _optional_int(energy_generated), _optional_float(efficiency),
+                        _optional_int(energy_exported), _optional_int(energy_used), _optional_int(peak_power),
+                        None if peak_time in ("NaN", "") else from_pvoutput_time(peak_time), condition,
+                        _optional_float(temperature_min), _optional_float(temperature_max),
+                        _optional_int(peak_energy_import), _optional_int(off_peak_energy_import),
+                        _optional_int(shoulder_energy_import), _optional_int(high_shoulder_energy_import)))
+    return r